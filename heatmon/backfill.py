@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+
+# Copyright 2021 Tristan Keen
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Convert captured packets to OpenMetrics text for backfilling Prometheus
+
+Reads packet_capture files ("<unix time> <rssi> <packet hex>" per line, each preceded by its
+rotated .N ... .1 files) in one pass, decodes them as heatmon would have, and writes timestamped
+gauge samples for importing with:
+
+    promtool tsdb create-blocks-from openmetrics <output> <prometheus data dir>
+"""
+
+import argparse
+import logging
+import shutil
+import sys
+import tempfile
+
+from .capture import capture_files
+from .frame import Frame
+from .push import escape_label_value
+from .stats import LAST_REPORT_TIME, RADIO_RSSI, iter_frame_stats
+from .system import System
+
+logger = logging.getLogger(__name__)
+
+
+class OpenMetricsWriter:
+    """Writes samples grouped by metric family, as OpenMetrics requires, in bounded memory
+
+    Each family's samples are spooled to their own temporary file as they arrive, then all are
+    copied out family by family at the end.
+    """
+
+    def __init__(self):
+        self._families = {}
+
+    def add(self, metric, trv_name, value, timestamp):
+        family = self._families.get(metric)
+        if family is None:
+            description = metric.describe()[0]
+            spool = tempfile.TemporaryFile("w+", encoding="utf-8")
+            family = self._families[metric] = (description, spool)
+        description, spool = family
+        label = escape_label_value(trv_name)
+        spool.write(f'{description.name}{{trv="{label}"}} {float(value)} {timestamp}\n')
+
+    def write(self, out):
+        for description, spool in self._families.values():
+            out.write(f"# TYPE {description.name} {description.type}\n")
+            if description.unit:
+                out.write(f"# UNIT {description.name} {description.unit}\n")
+            out.write(f"# HELP {description.name} {description.documentation}\n")
+            spool.seek(0)
+            shutil.copyfileobj(spool, out)
+            spool.close()
+        self._families = {}
+        out.write("# EOF\n")
+
+
+def read_capture(lines):
+    """Yield (line_num, timestamp, rssi, packet) from capture lines, skipping unreadable ones"""
+    for line_num, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        try:
+            timestamp, rssi, packet_hex = line.split()
+            yield line_num, float(timestamp), float(rssi), bytes.fromhex(packet_hex)
+        except ValueError:
+            logger.warning("Skipping unreadable capture line %d: %s", line_num, line[:80])
+
+
+def backfill(lines, writer):
+    # Per TRV, so duplicated or out of order packets don't give promtool conflicting samples
+    last_timestamp = {}
+    num_frames = 0
+    for line_num, timestamp, rssi, packet in read_capture(lines):
+        try:
+            frame = Frame(packet)
+        except Exception as e:
+            # Every packet heard is captured, including ones heatmon itself couldn't handle
+            logger.warning("Skipping undecodable packet on capture line %d: %r", line_num, e)
+            continue
+        if frame.corrupt or not frame.stats:
+            continue
+        trv_name = frame.trv_name
+        if timestamp <= last_timestamp.get(trv_name, 0):
+            continue
+        last_timestamp[trv_name] = timestamp
+
+        writer.add(RADIO_RSSI, trv_name, rssi, timestamp)
+        writer.add(LAST_REPORT_TIME, trv_name, timestamp, timestamp)
+        for metric, value in iter_frame_stats(frame):
+            writer.add(metric, trv_name, value, timestamp)
+        num_frames += 1
+    return num_frames
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "captures", nargs="+", help="Capture files, oldest first, each after its rotated files"
+    )
+    parser.add_argument("--config", default="./heatmon.yaml", help="For TRV ids & keys")
+    parser.add_argument("--output", "-o", default="-", help="OpenMetrics file, - for stdout")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    # Registers the known TRVs and keys with Frame, without touching any hardware
+    System(args.config)
+
+    writer = OpenMetricsWriter()
+    num_frames = 0
+    for capture in [path for capture in args.captures for path in capture_files(capture)]:
+        with open(capture, "r") as f:
+            num_frames += backfill(f, writer)
+
+    out = sys.stdout if args.output == "-" else open(args.output, "w")
+    try:
+        writer.write(out)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    print(f"Wrote {num_frames} frames", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
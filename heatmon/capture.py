@@ -0,0 +1,66 @@
+# Copyright 2021 Tristan Keen
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+
+
+class PacketCapture:
+    """Appends "<unix time> <rssi> <packet hex>" lines, rotating files to cap disk use
+
+    Rotation is as logging's RotatingFileHandler: when path reaches max_bytes it is renamed to
+    path.1, path.1 to path.2 and so on, with anything beyond path.<backups> deleted.
+    """
+
+    def __init__(self, path, max_bytes=8 * 1024 * 1024, backups=7):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._file = None
+        self._open()
+
+    def _open(self):
+        # Line buffered so a crash loses at most the packet being written
+        self._file = open(self.path, "a", buffering=1)
+        self._size = self._file.tell()
+
+    def write(self, timestamp, rssi, packet):
+        line = f"{timestamp:.3f} {rssi} {bytes(packet).hex()}\n"
+        if self.max_bytes and self._size + len(line) > self.max_bytes and self._size:
+            self._rotate()
+        self._file.write(line)
+        self._size += len(line)
+
+    def _rotate(self):
+        self._file.close()
+        for n in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{n}"):
+                os.replace(f"{self.path}.{n}", f"{self.path}.{n + 1}")
+        if self.backups:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self._open()
+
+    def close(self):
+        self._file.close()
+
+
+def capture_files(path):
+    """A capture path's rotated files that exist, oldest first, then path itself"""
+    rotated = []
+    n = 1
+    while os.path.exists(f"{path}.{n}"):
+        rotated.append(f"{path}.{n}")
+        n += 1
+    return rotated[::-1] + [path]
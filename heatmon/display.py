@@ -17,6 +17,8 @@ import board
 import busio
 from digitalio import DigitalInOut
 
+from .glyphs import GlyphCache
+
 
 class Display:
     def __init__(self):
@@ -34,12 +36,15 @@ class Display:
         self._text_height = 11
         self._max_text_lines = 3
         self._text = []
+        self._glyphs = GlyphCache("font5x8.bin", self._width)
+        self._shown_text = ()
 
     def clear(self, display=True):
         self._text = []
         if display:
             self._display.fill(0)
             self._display.show()
+            self._shown_text = ()
 
     def append_line(self, text):
         if len(self._text) >= self._max_text_lines:
@@ -54,7 +59,10 @@ class Display:
         self._text[line_num] = text
 
     def show_lines(self):
-        self._display.fill(0)
-        for i, text in enumerate(self._text):
-            self._display.text(text, 0, i * self._text_height, 1)
+        text = tuple(self._text)
+        if text == self._shown_text:
+            # Nothing changed, so skip redrawing & sending over I2C
+            return
+        self._glyphs.draw_lines(self._display.buf, text, self._text_height)
         self._display.show()
+        self._shown_text = text
@@ -0,0 +1,100 @@
+# Copyright 2021 Tristan Keen
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Stand-ins for RPi.GPIO and an SPI-attached RFM69, to run Radio without hardware"""
+
+
+class FakeGPIO:
+    IN = "in"
+    RISING = "rising"
+
+    def __init__(self):
+        self.callbacks = {}
+        self.pins = set()
+
+    def setup(self, channel, direction):
+        self.pins.add(channel)
+
+    def add_event_detect(self, channel, edge):
+        if channel in self.callbacks:
+            raise RuntimeError(f"Conflicting edge detection already enabled for GPIO {channel}")
+        self.callbacks[channel] = []
+
+    def add_event_callback(self, channel, callback):
+        self.callbacks[channel].append(callback)
+
+    def remove_event_detect(self, channel):
+        self.callbacks.pop(channel, None)
+
+    def cleanup(self, channel=None):
+        if channel is None:
+            self.pins.clear()
+            self.callbacks.clear()
+        else:
+            self.pins.discard(channel)
+
+    def trigger(self, channel):
+        for callback in self.callbacks.get(channel, []):
+            callback(channel)
+
+
+class FakeRFM69:
+    """Just the registers & calls Radio uses, with receive() to have a packet arrive"""
+
+    def __init__(self, gpio, config):
+        self._gpio = gpio
+        self.config = config
+        self.frequency_mhz = config.frequency
+        self.listening = False
+        self.rssi = 0
+        self._fifo = b""
+
+    def listen(self):
+        self.listening = True
+
+    def idle(self):
+        self.listening = False
+
+    def reset(self):
+        self.listening = False
+        self._fifo = b""
+
+    def payload_ready(self):
+        return len(self._fifo) > 0
+
+    def _read_u8(self, address):
+        return len(self._fifo)
+
+    def _read_into(self, address, buf, length):
+        buf[:length] = self._fifo[:length]
+        self._fifo = b""
+
+    def receive(self, frame, rssi):
+        """Receive a frame (without its length byte), raising DIO0 if listening"""
+        if not self.listening:
+            return
+        self._fifo = bytes(frame)
+        self.rssi = rssi
+        self._gpio.trigger(self.config.dio0)
+
+
+class FakeRadioBackend:
+    def __init__(self):
+        self.gpio = FakeGPIO()
+        self.rfm69s = {}
+
+    def create_rfm69(self, config):
+        rfm69 = FakeRFM69(self.gpio, config)
+        self.rfm69s[config.id] = rfm69
+        return rfm69
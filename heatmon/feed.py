@@ -0,0 +1,183 @@
+# Copyright 2021 Tristan Keen
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import logging
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from queue import Empty, Full, Queue
+
+from prometheus_client import Counter, Gauge
+
+from .stats import COMPACT_STAT_METRIC_NAMES
+
+logger = logging.getLogger(__name__)
+
+FEED_SUBSCRIBERS = Gauge("feed_subscribers", "Clients connected to the event feed")
+FEED_DROPPED_SUBSCRIBERS = Counter(
+    "feed_dropped_subscribers", "Event feed clients disconnected for not keeping up"
+)
+FEED_DROPPED_EVENTS = Counter(
+    "feed_dropped_events", "Events discarded as the feed couldn't flush them quickly enough"
+)
+
+# Frame flags that get a "change" event when they differ from the TRV's previous frame
+STATE_FIELDS = ["call_for_heat", "fault", "battery_low", "tamper", "frost_risk"]
+
+
+class EventFeed:
+    """Streams decoded frames and TRV state changes to clients as JSON lines over SSE
+
+    publish_frame() only appends to a bounded deque so never blocks gather_stats. A flush thread
+    batches whatever is pending each flush_interval into one SSE message per subscriber, with
+    one JSON object per "data:" line. A client whose buffer of unsent batches fills up is dropped.
+    """
+
+    def __init__(self, flush_interval=1.0, subscriber_buffer=32, max_pending=1000):
+        self.flush_interval = flush_interval
+        self.subscriber_buffer = subscriber_buffer
+        self._pending = deque(maxlen=max_pending)
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._last_state = {}
+        self._stop = threading.Event()
+        self._server = None
+
+    def publish(self, event):
+        if len(self._pending) == self._pending.maxlen:
+            FEED_DROPPED_EVENTS.inc()
+        self._pending.append(event)
+
+    def publish_frame(self, frame, rssi, now, receiver_id=None, compact_stats=()):
+        """compact_stats are the (metric, value) pairs parse_stats returned for the frame"""
+        trv_name = frame.trv_name
+        event = {
+            "event": "frame",
+            "time": now,
+            "trv": trv_name,
+            "receiver": receiver_id,
+            "rssi": rssi,
+            "restart_counter": frame.restart_counter,
+            "message_counter": frame.message_counter,
+            "valve_open_percent": frame.valve_open_percent,
+            "occupancy": frame.occupancy,
+            "stats": {COMPACT_STAT_METRIC_NAMES[metric]: value for metric, value in compact_stats},
+        }
+        for field in STATE_FIELDS:
+            event[field] = getattr(frame, field)
+        self.publish(event)
+
+        # Only configured TRVs can be decrypted, and System won't cap max_tracked_trvs below
+        # their number, so this holds no more TRVs than the metrics do
+        previous = self._last_state.get(trv_name, {})
+        for field in STATE_FIELDS:
+            value = event[field]
+            if previous.get(field) != value:
+                self.publish(
+                    {
+                        "event": "change",
+                        "time": now,
+                        "trv": trv_name,
+                        "field": field,
+                        "old": previous.get(field),
+                        "new": value,
+                    }
+                )
+        self._last_state[trv_name] = {field: event[field] for field in STATE_FIELDS}
+
+    def subscribe(self):
+        subscriber = Queue(maxsize=self.subscriber_buffer)
+        with self._lock:
+            self._subscribers.add(subscriber)
+            FEED_SUBSCRIBERS.set(len(self._subscribers))
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+            FEED_SUBSCRIBERS.set(len(self._subscribers))
+
+    def is_subscribed(self, subscriber):
+        with self._lock:
+            return subscriber in self._subscribers
+
+    def flush(self):
+        lines = []
+        while self._pending:
+            lines.append("data: " + json.dumps(self._pending.popleft(), separators=(",", ":")))
+        if not lines:
+            return
+        message = ("\n".join(lines) + "\n\n").encode("utf-8")
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(message)
+            except Full:
+                logger.warning("Dropping event feed subscriber that isn't keeping up")
+                FEED_DROPPED_SUBSCRIBERS.inc()
+                self.unsubscribe(subscriber)
+
+    def start(self, addr, port):
+        feed = self
+
+        class Handler(EventFeedHandler):
+            event_feed = feed
+
+        self._server = ThreadingHTTPServer((addr, port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="feed-server", daemon=True).start()
+        threading.Thread(target=self._run_flush, name="feed-flush", daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def _run_flush(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+
+class EventFeedHandler(BaseHTTPRequestHandler):
+    event_feed = None
+    keepalive_interval = 15.0
+
+    def do_GET(self):
+        if self.path != "/events":
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+
+        subscriber = self.event_feed.subscribe()
+        try:
+            while self.event_feed.is_subscribed(subscriber):
+                try:
+                    message = subscriber.get(timeout=self.keepalive_interval)
+                except Empty:
+                    message = b": keepalive\n\n"
+                self.wfile.write(message)
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            self.event_feed.unsubscribe(subscriber)
+
+    def log_message(self, format, *args):
+        logger.debug("Event feed %s: " + format, self.address_string(), *args)
@@ -17,6 +17,8 @@ import logging
 from cryptography.exceptions import InvalidTag
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 
+logger = logging.getLogger(__name__)
+
 # from pprint import pprint
 
 
@@ -25,17 +27,42 @@ class Frame:
     SECURE_FRAME_TYPE = 0xCF
 
     KNOWN_TRV_IDS_TO_NAMES = {}
+    # Only for TRVs with their own key(s), others use the global DECRYPTOR
+    KNOWN_TRV_IDS_TO_DECRYPTORS = {}
     DECRYPTOR = None
+    # One cipher context per distinct key, shared between all TRVs using it
+    DECRYPTORS_BY_KEY = {}
+
+    @staticmethod
+    def decryptor_for_key(key):
+        decryptor = Frame.DECRYPTORS_BY_KEY.get(key)
+        if decryptor is None:
+            decryptor = AESGCM(key)
+            Frame.DECRYPTORS_BY_KEY[key] = decryptor
+        return decryptor
 
     @staticmethod
     def register_known_trvs(trvs):
         for trv in trvs:
-            logging.info(f"Known TRVs: {trv.id.hex()} = {trv.name}")
+            logger.info("Known TRVs: %s = %s", trv.id.hex(), trv.name)
             Frame.KNOWN_TRV_IDS_TO_NAMES[trv.id] = trv.name
+            if trv.secure_key is None and trv.previous_secure_key is None:
+                continue
+            # Try the new key first, so only packets sent before the rotation cost 2 attempts
+            decryptors = [Frame.DECRYPTOR]
+            if trv.secure_key is None and Frame.DECRYPTOR is None:
+                raise ValueError(
+                    f"TRV {trv.name} rotating to the global secure_key, but none was registered"
+                )
+            if trv.secure_key is not None:
+                decryptors = [Frame.decryptor_for_key(trv.secure_key)]
+            if trv.previous_secure_key is not None:
+                decryptors.append(Frame.decryptor_for_key(trv.previous_secure_key))
+            Frame.KNOWN_TRV_IDS_TO_DECRYPTORS[trv.id] = tuple(decryptors)
 
     @staticmethod
     def register_secure_key(key):
-        Frame.DECRYPTOR = AESGCM(key)
+        Frame.DECRYPTOR = Frame.decryptor_for_key(key)
 
     def __init__(self, packet: bytearray):
         self.packet = packet
@@ -56,7 +83,8 @@ class Frame:
         self.trailer = bytes()
         self.auth_tag = bytes()
         self.data = bytes()
-        self.json_text = ""
+        self.stats = bytes()
+        self.stats_terminated = False
 
         self.corrupt = packet is None or len(packet) < 8
         self.unknown_trv = True
@@ -105,7 +133,7 @@ class Frame:
             if id[: self.id_len] == self.id
         ]
         if not matching:
-            logging.warning(f"Unknown TRV with id starting: {self.id.hex()}")
+            logger.warning("Unknown TRV with id starting: %s", self.id.hex())
         else:
             if self.frame_type != Frame.SECURE_FRAME_TYPE:
                 raise NotImplementedError("No processing of open messages...")
@@ -114,17 +142,22 @@ class Frame:
             for maybe_id, maybe_name in matching:
                 # First 6 bytes of Trailer is reset_counter + message_counter
                 nonce = maybe_id[:6] + self.trailer[0:6]
-                try:
-                    self.data = Frame.DECRYPTOR.decrypt(nonce, data_and_tag, self.header)
-                    self.id = maybe_id
-                    self.trv_name = maybe_name
-                    self.unknown_trv = False
-                    break
-                except InvalidTag:
-                    # Decrypt didn't work - not this TRV ID match or key
-                    pass
+                decryptors = Frame.KNOWN_TRV_IDS_TO_DECRYPTORS.get(maybe_id, (Frame.DECRYPTOR,))
+                for decryptor in decryptors:
+                    try:
+                        self.data = decryptor.decrypt(nonce, data_and_tag, self.header)
+                        break
+                    except InvalidTag:
+                        # Decrypt didn't work - not this TRV ID match or key
+                        pass
+                else:
+                    continue
+                self.id = maybe_id
+                self.trv_name = maybe_name
+                self.unknown_trv = False
+                break
             else:
-                logging.error(f"Failed to decrypt packet from {self.id.hex()}")
+                logger.error("Failed to decrypt packet from %s", self.id.hex())
 
             if len(self.data) > 0:
                 # Decode from https://github.com/opentrv/OpenTRV-standards/blob/master/standards/
@@ -142,10 +175,17 @@ class Frame:
                 self.occupancy = (self.data[1] & 0x0C) >> 2
                 self.frost_risk = (self.data[1] & 0x02) != 0
                 if stats_present:
+                    # Compact JSON stats, NUL padded & with the closing "}" left off by the TRV
                     end = self.data.find(b"\x00", 2)
-                    self.json_text = (
-                        self.data[2:end].decode(encoding="utf-8", errors="strict") + "}"
-                    )
+                    self.stats = bytes(self.data[2 : end if end >= 0 else len(self.data)])
+                    self.stats_terminated = end >= 0
+
+    @property
+    def json_text(self):
+        # Only for logging - parse_stats works directly on the stats bytes
+        if not self.stats:
+            return ""
+        return self.stats.decode(encoding="utf-8", errors="replace") + "}"
 
     def semi_ok(self):
         return self.frame_len > 4 and self.frame_type == Frame.SECURE_FRAME_TYPE
@@ -174,8 +214,11 @@ class Frame:
             f"Occ{self.occupancy} {self.json_text}"
         )
 
+    def __str__(self):
+        return self.one_line_summary()
+
     def debug(self):
-        if not logging.getLogger().isEnabledFor(logging.DEBUG):
+        if not logger.isEnabledFor(logging.DEBUG):
             return
         status = "GOOD"
         if self.corrupt:
@@ -196,4 +239,4 @@ class Frame:
                     + " ".join("{:02x}".format(x) for x in self.data)
                     + f" {self.data}\n"
                 )
-        logging.debug(msg)
+        logger.debug(msg)
@@ -0,0 +1,79 @@
+# Copyright 2021 Tristan Keen
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from collections import OrderedDict
+
+# Per-byte tables for bytes.translate(), moving each column byte down by 0-7 pixels into
+# the page it starts in (LOW) and the rest into the page below (HIGH)
+_SHIFT_LOW = [bytes((b << shift) & 0xFF for b in range(256)) for shift in range(8)]
+_SHIFT_HIGH = [bytes(b >> (8 - shift) for b in range(256)) for shift in range(8)]
+
+
+class GlyphCache:
+    """Draws text lines straight into an SSD1306 (MVLSB) framebuffer
+
+    Pixel for pixel the same as adafruit_framebuf's text() with its font5x8.bin file, but the
+    font is read once and each line is cached as ready-shifted rows of column bytes. A redraw
+    is then a couple of bulk ORs and copies per 8 pixel page, rather than a file seek & read
+    per glyph column and a fill_rect per pixel.
+    """
+
+    def __init__(self, font_path="font5x8.bin", width=128, max_cached_lines=32):
+        with open(font_path, "rb") as f:
+            font = f.read()
+        self.font_width, self.font_height = font[0], font[1]
+        if len(font) != 2 + 256 * self.font_width or self.font_height > 8:
+            raise RuntimeError(f"Invalid font file: {font_path}")
+        # Each glyph's columns plus the blank column separating it from the next
+        self._glyphs = [
+            font[2 + i * self.font_width : 2 + (i + 1) * self.font_width] + b"\x00"
+            for i in range(256)
+        ]
+        self._width = width
+        self._max_cached_lines = max_cached_lines
+        self._lines = OrderedDict()
+
+    def _line_rows(self, text, y):
+        key = (text, y)
+        rows = self._lines.get(key)
+        if rows is not None:
+            self._lines.move_to_end(key)
+            return rows
+        unknown = self._glyphs[ord("?")]
+        columns = b"".join(self._glyphs[ord(c)] if ord(c) < 256 else unknown for c in text)
+        columns = columns[: self._width].ljust(self._width, b"\x00")
+        shift = y & 0x07
+        rows = (
+            y >> 3,
+            int.from_bytes(columns.translate(_SHIFT_LOW[shift]), "little"),
+            int.from_bytes(columns.translate(_SHIFT_HIGH[shift]), "little") if shift else 0,
+        )
+        self._lines[key] = rows
+        if len(self._lines) > self._max_cached_lines:
+            self._lines.popitem(last=False)
+        return rows
+
+    def draw_lines(self, buf, lines, line_height):
+        """Replace the whole of buf with lines of text, line i starting at y=i*line_height"""
+        num_pages = len(buf) // self._width
+        pages = [0] * num_pages
+        for i, text in enumerate(lines):
+            page, low, high = self._line_rows(text, i * line_height)
+            if page < num_pages:
+                pages[page] |= low
+            if page + 1 < num_pages:
+                pages[page + 1] |= high
+        for page, row in enumerate(pages):
+            start = page * self._width
+            buf[start : start + self._width] = row.to_bytes(self._width, "little")
@@ -0,0 +1,156 @@
+# Copyright 2021 Tristan Keen
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import atexit
+import json
+import logging
+import time
+from logging.handlers import QueueHandler, QueueListener
+from queue import Full, Queue
+
+from prometheus_client import Counter
+
+LOGS_DROPPED = Counter("log_records_dropped", "Log records dropped as the log queue was full")
+
+TEXT_FORMAT = "%(asctime)s.%(msecs)03d %(levelname)-8s [%(filename)s:%(lineno)d] %(message)s"
+# Running under Systemd - no need for timestamp as journald provides
+JOURNALD_TEXT_FORMAT = "%(levelname)-8s [%(filename)s:%(lineno)d] %(message)s"
+
+# Attributes of every LogRecord, so anything else on one came from extra={...}
+_STANDARD_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {
+    "message",
+    "asctime",
+}
+
+_override_levels = {}
+_listener = None
+
+
+class StructuredFormatter(logging.Formatter):
+    """One event per line as JSON or key=value pairs, including any extra={...} fields"""
+
+    def __init__(self, style="json", timestamps=True):
+        super().__init__()
+        self.style = style
+        self.timestamps = timestamps
+
+    def format(self, record):
+        fields = {}
+        if self.timestamps:
+            fields["time"] = time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created))
+            fields["time"] += f".{int(record.msecs):03d}"
+        fields["level"] = record.levelname
+        fields["logger"] = record.name
+        fields["msg"] = record.getMessage()
+        for key, value in vars(record).items():
+            if key not in _STANDARD_RECORD_ATTRS and not key.startswith("_"):
+                fields[key] = value
+        if record.exc_info:
+            fields["exc"] = self.formatException(record.exc_info)
+        if self.style == "json":
+            return json.dumps(fields, default=str)
+        return " ".join(f"{key}={json.dumps(value, default=str)}" for key, value in fields.items())
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """Hands records to a background thread as they are, dropping them if it falls behind
+
+    Unlike QueueHandler, the message isn't formatted here, so that cost is also paid in the
+    background thread. Log arguments mustn't be changed after they're logged as a result.
+    """
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except Full:
+            LOGS_DROPPED.inc()
+
+
+def parse_module_levels(text):
+    """Parse "module=LEVEL,..." as used by the LOG_LEVELS environment variable"""
+    levels = {}
+    for item in text.split(","):
+        if item.strip():
+            module, _, level = item.partition("=")
+            levels[module.strip()] = level.strip().upper()
+    return levels
+
+
+def set_levels(level=None, module_levels=None):
+    if level:
+        logging.getLogger().setLevel(str(level).upper())
+    for module, module_level in (module_levels or {}).items():
+        logging.getLogger(module).setLevel(str(module_level).upper())
+
+
+def apply_config_levels(config):
+    """Apply a logging: section of heatmon.yaml, keeping any levels given to configure_logging"""
+    set_levels(config.get("level"), config.get("modules"))
+    set_levels(_override_levels.get(""), {k: v for k, v in _override_levels.items() if k})
+
+
+def configure_logging(
+    level=None,
+    module_levels=None,
+    log_format="text",
+    async_logging=False,
+    journald=False,
+    queue_size=10000,
+):
+    """Set up the root logger, optionally writing from a background thread via a queue
+
+    log_format is "text" for the classic layout, or "json" / "kv" for structured events.
+    Levels given here override any from heatmon.yaml, with everything at DEBUG by default.
+    """
+    global _listener
+
+    if log_format == "text":
+        formatter = logging.Formatter(
+            JOURNALD_TEXT_FORMAT if journald else TEXT_FORMAT, datefmt="%Y-%m-%d %H:%M:%S"
+        )
+    else:
+        formatter = StructuredFormatter(log_format, timestamps=not journald)
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(formatter)
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    stop_logging()
+
+    if async_logging:
+        log_queue = Queue(maxsize=queue_size)
+        root.addHandler(NonBlockingQueueHandler(log_queue))
+        _listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+        _listener.start()
+    else:
+        root.addHandler(stream_handler)
+
+    _override_levels.clear()
+    if level:
+        _override_levels[""] = level
+    _override_levels.update(module_levels or {})
+    set_levels(level or "DEBUG", module_levels)
+
+
+@atexit.register
+def stop_logging():
+    """Write out anything still queued for the background thread"""
+    global _listener
+    if _listener:
+        _listener.stop()
+        _listener = None
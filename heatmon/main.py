@@ -20,32 +20,68 @@ from os import environ
 
 from prometheus_client import start_http_server
 
+from .feed import EventFeed
+from .logs import configure_logging, parse_module_levels
+from .push import PushExporter
 from .system import System
 
+logger = logging.getLogger(__name__)
+
 # Warning, may want to switch METRICS_IP back to 127.0.0.1
 METRICS_IP = environ.get("METRICS_IP", "0.0.0.0")
 METRICS_PORT = int(environ.get("METRICS_PORT", "8000"))
 
-log_format = "%(asctime)s.%(msecs)03d %(levelname)-8s [%(filename)s:%(lineno)d] %(message)s"
-if "INVOCATION_ID" in environ:
-    # Running under Systemd - no need for timestamp as journald provides
-    log_format = "%(levelname)-8s [%(filename)s:%(lineno)d] %(message)s"
+# Optionally also push metrics to a central server, buffering on disk while it's unreachable
+PUSH_URL = environ.get("PUSH_URL", "")
+PUSH_INTERVAL = float(environ.get("PUSH_INTERVAL", "60"))
+PUSH_BUFFER_DIR = environ.get("PUSH_BUFFER_DIR", "./push-buffer")
+PUSH_BUFFER_MAX = int(environ.get("PUSH_BUFFER_MAX", "1440"))
+
+# Optional SSE feed of decoded frames & state changes on http://METRICS_IP:FEED_PORT/events
+FEED_PORT = int(environ.get("FEED_PORT", "0"))
+FEED_FLUSH_INTERVAL = float(environ.get("FEED_FLUSH_INTERVAL", "1.0"))
+FEED_SUBSCRIBER_BUFFER = int(environ.get("FEED_SUBSCRIBER_BUFFER", "32"))
 
-logging.basicConfig(
-    format=log_format,
-    datefmt="%Y-%m-%d %H:%M:%S",
-    level=logging.DEBUG,
-)
+# Logging levels, e.g. LOG_LEVEL=INFO LOG_LEVELS=heatmon.frame=WARNING,heatmon.radio=DEBUG
+# ... overriding any in heatmon.yaml
+LOG_LEVEL = environ.get("LOG_LEVEL", "")
+LOG_LEVELS = parse_module_levels(environ.get("LOG_LEVELS", ""))
+# "text", or "json" / "kv" for structured events
+LOG_FORMAT = environ.get("LOG_FORMAT", "text")
+# Write logs from a background thread, so the packet loop never waits on log I/O
+LOG_ASYNC = environ.get("LOG_ASYNC", "0") not in ("", "0", "false")
 
 
 def main():
-    logging.info("Heatmon starting...")
+    configure_logging(
+        level=LOG_LEVEL,
+        module_levels=LOG_LEVELS,
+        log_format=LOG_FORMAT,
+        async_logging=LOG_ASYNC,
+        # Running under Systemd - no need for timestamp as journald provides
+        journald="INVOCATION_ID" in environ,
+    )
+    logger.info("Heatmon starting...")
 
     # Expose prometheus metrics
     start_http_server(addr=METRICS_IP, port=METRICS_PORT)
+    if PUSH_URL:
+        pusher = PushExporter(
+            PUSH_URL,
+            interval=PUSH_INTERVAL,
+            buffer_dir=PUSH_BUFFER_DIR,
+            max_buffered=PUSH_BUFFER_MAX,
+        )
+        pusher.start()
+    feed = None
+    if FEED_PORT:
+        feed = EventFeed(
+            flush_interval=FEED_FLUSH_INTERVAL, subscriber_buffer=FEED_SUBSCRIBER_BUFFER
+        )
+        feed.start(METRICS_IP, FEED_PORT)
 
     try:
-        system = System()
+        system = System(feed=feed)
         system.gather_stats()
     except KeyboardInterrupt:
         print("Exiting due to KeyboardInterrupt...", file=sys.stderr, flush=True)
@@ -0,0 +1,155 @@
+# Copyright 2021 Tristan Keen
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import gzip
+import logging
+import os
+import socket
+import threading
+import time
+from http.client import HTTPException
+from urllib.error import HTTPError, URLError
+from urllib.request import Request, urlopen
+
+from prometheus_client import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+
+def escape_label_value(value):
+    return value.replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\"")
+
+
+class PushExporter:
+    """Periodically push all metrics to a central HTTP endpoint
+
+    Each batch is a gzipped snapshot of the registry in Prometheus text format with explicit
+    timestamps, so batches that had to wait in the on-disk buffer keep their original times.
+    """
+
+    def __init__(
+        self,
+        url,
+        interval=60.0,
+        buffer_dir="./push-buffer",
+        max_buffered=1440,
+        instance=None,
+        timeout=10.0,
+        registry=REGISTRY,
+    ):
+        self.url = url
+        self.interval = interval
+        self.buffer_dir = buffer_dir
+        self.max_buffered = max_buffered
+        self.instance = instance or socket.gethostname()
+        self.timeout = timeout
+        self._registry = registry
+        self._stop = threading.Event()
+        self._thread = None
+        os.makedirs(self.buffer_dir, exist_ok=True)
+        buffered = self._buffered_files()
+        self._next_seq = int(buffered[-1].split(".")[0]) + 1 if buffered else 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="push-exporter", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.push_once()
+            except Exception:
+                logger.exception("Unexpected error pushing metrics")
+
+    def collect_batch(self, now=None):
+        timestamp_ms = int((now if now is not None else time.time()) * 1000)
+        instance = f'instance="{escape_label_value(self.instance)}"'
+        lines = []
+        for metric in self._registry.collect():
+            for sample in metric.samples:
+                # Counters' creation times aren't wanted as series of their own
+                if sample.name.endswith("_created"):
+                    continue
+                labels = [instance] + [
+                    f'{name}="{escape_label_value(value)}"'
+                    for name, value in sorted(sample.labels.items())
+                ]
+                lines.append(f"{sample.name}{{{','.join(labels)}}} {sample.value} {timestamp_ms}\n")
+        return "".join(lines).encode("utf-8")
+
+    def push_once(self, now=None):
+        batch = gzip.compress(self.collect_batch(now))
+        if not self._buffered_files() and self._send(batch):
+            return True
+        self._buffer(batch)
+        return self.flush_buffer()
+
+    def flush_buffer(self):
+        """Send buffered batches oldest first, stopping at the first failure to keep order"""
+        for name in self._buffered_files():
+            path = os.path.join(self.buffer_dir, name)
+            with open(path, "rb") as f:
+                batch = f.read()
+            if not self._send(batch):
+                return False
+            os.remove(path)
+        return True
+
+    def _buffered_files(self):
+        return sorted(name for name in os.listdir(self.buffer_dir) if name.endswith(".gz"))
+
+    def _buffer(self, batch):
+        name = f"{self._next_seq:012d}.gz"
+        self._next_seq += 1
+        tmp_path = os.path.join(self.buffer_dir, name + ".tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(batch)
+        os.replace(tmp_path, os.path.join(self.buffer_dir, name))
+
+        buffered = self._buffered_files()
+        for old_name in buffered[: max(0, len(buffered) - self.max_buffered)]:
+            logger.warning("Push buffer full, dropping oldest batch %s", old_name)
+            os.remove(os.path.join(self.buffer_dir, old_name))
+
+    def _send(self, batch):
+        """True once the batch is finished with: sent, or permanently rejected"""
+        request = Request(
+            self.url,
+            data=batch,
+            method="POST",
+            headers={
+                "Content-Type": "text/plain; version=0.0.4",
+                "Content-Encoding": "gzip",
+            },
+        )
+        try:
+            with urlopen(request, timeout=self.timeout) as response:
+                response.read()
+            return True
+        except HTTPError as e:
+            e.close()
+            if 400 <= e.code < 500 and e.code != 429:
+                # Retrying won't help, and would hold up every later batch behind this one
+                logger.error("Metrics batch rejected by %s, dropping it: %s", self.url, e)
+                return True
+            logger.warning("Failed to push metrics to %s: %s", self.url, e)
+            return False
+        except (URLError, OSError, HTTPException) as e:
+            logger.warning("Failed to push metrics to %s: %s", self.url, e)
+            return False
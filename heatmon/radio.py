@@ -14,40 +14,118 @@
 
 import logging
 import sys
+import threading
+import time
+from collections import OrderedDict
 from queue import Empty, Full, Queue
 
-import adafruit_rfm69
-import board
-import busio
-import RPi.GPIO as GPIO
-from digitalio import DigitalInOut
-from micropython import const
+from .stats import PACKETS_DROPPED, RECEIVER_DUPLICATES, RECEIVER_PACKETS, RECEIVER_RSSI
+
+logger = logging.getLogger(__name__)
+
+
+class RadioConfig:
+    def __init__(self, config=None):
+        config = config or {}
+        # Defaults are the original single RFM69 bonnet
+        self.id = str(config.get("id", "radio0"))
+        self.chip_select = config.get("chip_select", "CE1")
+        self.reset = config.get("reset", "D25")
+        self.dio0 = int(config.get("dio0", 22))
+        self.frequency = float(config.get("frequency", 868.5))
+        self.bitrate = int(config.get("bitrate", 57600))
+
+
+class PacketIngest:
+    """Queue of packets from all radios, dropping copies of one packet heard by several"""
+
+    def __init__(self, maxsize=64, duplicate_window=2.0):
+        self._queue = Queue(maxsize=maxsize)
+        self._duplicate_window = duplicate_window
+        # Packet contents to when first heard, oldest first
+        self._recent = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, packet, rssi, receiver_id, timeout=1):
+        RECEIVER_PACKETS.labels(receiver_id).inc()
+        RECEIVER_RSSI.labels(receiver_id).set(rssi)
+        now = time.monotonic()
+        key = bytes(packet)
+        with self._lock:
+            while self._recent and next(iter(self._recent.values())) < now - self._duplicate_window:
+                self._recent.popitem(last=False)
+            if key in self._recent:
+                RECEIVER_DUPLICATES.labels(receiver_id).inc()
+                return False
+            self._recent[key] = now
+        try:
+            self._queue.put((packet, rssi, receiver_id), timeout=timeout)
+            return True
+        except Full:
+            logger.warning("Dropping packet as queue full!")
+            PACKETS_DROPPED.inc()
+            return False
+
+    def wait_for_packet_queue(self, timeout=60.0):
+        try:
+            return self._queue.get(timeout=timeout)
+        except Empty:
+            pass
+        return None, None, None
 
 
-class Radio:
-    REG_FIFO = const(0x00)
+class HardwareBackend:
+    """RFM69s on the Pi's SPI bus, with DIO0 interrupts via RPi.GPIO"""
 
     def __init__(self):
-        self._rfm69 = None
+        # Blinka's board sets RPi.GPIO to BCM pin numbering, which dio0 uses, when imported
+        import board  # noqa: F401
+        import RPi.GPIO as GPIO
+
+        self.gpio = GPIO
+        self._spi = None
+
+    def create_rfm69(self, config):
+        import adafruit_rfm69
+        import board
+        import busio
+        from digitalio import DigitalInOut
+
+        chip_select = DigitalInOut(getattr(board, config.chip_select))
+        reset = DigitalInOut(getattr(board, config.reset))
+        if self._spi is None:
+            self._spi = busio.SPI(board.SCK, MOSI=board.MOSI, MISO=board.MISO)
+        # Preamble is 40 bits, detect at 20 => 3 bytes for now???
+        return adafruit_rfm69.RFM69(
+            self._spi,
+            chip_select,
+            reset,
+            config.frequency,
+            sync_word=b"\x2d\xd4",
+            preamble_length=3,
+        )
 
-        # RFM69 setup
-        chip_select = DigitalInOut(board.CE1)
-        reset = DigitalInOut(board.D25)
-        spi = busio.SPI(board.SCK, MOSI=board.MOSI, MISO=board.MISO)
+
+class Radio:
+    REG_FIFO = 0x00
+
+    def __init__(self, config=None, ingest=None, backend=None):
+        self._rfm69 = None
+        self.config = config or RadioConfig()
+        self._ingest = ingest or PacketIngest()
+        backend = backend or HardwareBackend()
+        self._gpio = backend.gpio
 
         # Setup interrupt directly via RPi.GPIO as Blinka doesn't support interrupts
-        self._DIO0 = 22
-        GPIO.setup(self._DIO0, GPIO.IN)
+        self._DIO0 = self.config.dio0
+        self._gpio.setup(self._DIO0, self._gpio.IN)
 
         try:
-            # Preamble is 40 bits, detect at 20 => 3 bytes for now???
-            self._rfm69 = adafruit_rfm69.RFM69(
-                spi, chip_select, reset, 868.5, sync_word=b"\x2d\xd4", preamble_length=3
-            )
-            logging.info("RFM69 Initialised OK!")
+            self._rfm69 = backend.create_rfm69(self.config)
+            logger.info("RFM69 %s Initialised OK!", self.config.id)
         except RuntimeError as error:
             # Thrown on version mismatch
-            logging.fatal(f"RFM69 Error: {error}")
+            logger.fatal("RFM69 %s Error: %s", self.config.id, error)
             sys.exit(1)
 
         self._rfm69.modulation_type = 0b00  # FSK
@@ -55,16 +133,15 @@ class Radio:
         self._rfm69.modulation_shaping = 0b10  # Gaussian BT 0.5
         # ListenEnd?
 
-        self._rfm69.bitrate = 57600
+        self._rfm69.bitrate = self.config.bitrate
         self._rfm69.frequency_deviation = 28750
         self._rfm69.packet_format = 1  # Packet mode
         self._rfm69.dc_free = 0b00  # No Manchester/Whitening
         self._rfm69.crc_on = 0
 
         # Start receiving on callback
-        self._packet_queue = Queue(maxsize=64)
-        GPIO.add_event_detect(self._DIO0, GPIO.RISING)
-        GPIO.add_event_callback(self._DIO0, self.payload_ready_callback)
+        self._gpio.add_event_detect(self._DIO0, self._gpio.RISING)
+        self._gpio.add_event_callback(self._DIO0, self.payload_ready_callback)
         self._rfm69.listen()
 
     def payload_ready_callback(self, channel):
@@ -80,21 +157,15 @@ class Radio:
             self._rfm69._read_into(Radio.REG_FIFO, memoryview(packet)[1:], fifo_length)
         self._rfm69.listen()
         if fifo_length > 0:
-            try:
-                # packet includes its length byte at the start
-                self._packet_queue.put((packet, rssi), timeout=1)
-            except Full:
-                logging.warning("Dropping packet as queue full!")
+            # packet includes its length byte at the start
+            self._ingest.put(packet, rssi, self.config.id)
 
     def wait_for_packet_queue(self, timeout=60.0):
-        try:
-            return self._packet_queue.get(timeout=timeout)
-        except Empty:
-            pass
-        return None, None
+        packet, rssi, _ = self._ingest.wait_for_packet_queue(timeout)
+        return packet, rssi
 
     def reset(self):
         if self._rfm69:
             self._rfm69.reset()
-            GPIO.remove_event_detect(self._DIO0)
-            GPIO.cleanup(self._DIO0)
+            self._gpio.remove_event_detect(self._DIO0)
+            self._gpio.cleanup(self._DIO0)
@@ -0,0 +1,62 @@
+# Copyright 2021 Tristan Keen
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import math
+import sys
+
+
+class QuantileSketch:
+    """Streaming quantiles of positive values in bounded memory, after DDSketch
+
+    Values are counted in logarithmically sized buckets, so any quantile is returned within
+    relative_accuracy of the true value. Once there are more than max_buckets, the lowest
+    buckets are merged, trading accuracy on the smallest values for a fixed memory size.
+    See https://arxiv.org/abs/1908.10693
+    """
+
+    def __init__(self, relative_accuracy=0.02, max_buckets=64):
+        self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self._gamma)
+        self._max_buckets = max_buckets
+        self._buckets = {}
+        self._zero_count = 0
+        self.count = 0
+
+    def add(self, value):
+        self.count += 1
+        if value <= sys.float_info.min:
+            self._zero_count += 1
+            return
+        index = math.ceil(math.log(value) / self._log_gamma)
+        self._buckets[index] = self._buckets.get(index, 0) + 1
+        if len(self._buckets) > self._max_buckets:
+            lowest, next_lowest = sorted(self._buckets)[:2]
+            self._buckets[next_lowest] += self._buckets.pop(lowest)
+
+    def quantile(self, q):
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = self._zero_count
+        if seen > rank:
+            return 0.0
+        for index in sorted(self._buckets):
+            seen += self._buckets[index]
+            if seen > rank:
+                # Middle of the bucket, giving the bounded relative error
+                return 2 * self._gamma**index / (self._gamma + 1)
+        return 2 * self._gamma ** max(self._buckets) / (self._gamma + 1)
+
+    def approx_bytes(self):
+        return sys.getsizeof(self) + sys.getsizeof(self._buckets) + 64 * len(self._buckets)
@@ -0,0 +1,408 @@
+#!/usr/bin/env python3
+
+# Copyright 2021 Tristan Keen
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Soak test of the real System.gather_stats loop, fed by a simulated fleet of TRVs
+
+Runs anywhere - the display and the GPIO/SPI under Radio are replaced by fakes, but every
+packet is encrypted like a real TRV's and goes through Radio, Frame decoding and parse_stats
+as normal.
+"""
+
+import argparse
+import heapq
+import logging
+import os
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+from . import stats
+from .fake_radio import FakeRadioBackend
+from .frame import Frame
+from .radio import PacketIngest, Radio
+from .system import System
+
+# OpenTRV valves send stats roughly every 4 minutes
+DEFAULT_INTERVAL = 240.0
+MAX_LATENCY_SAMPLES = 100000
+
+
+def encode_secure_frame(trv_id, key, restart_counter, message_counter, data, seq_num=0):
+    """Build a secure frame as sent by a TRV, prefixed by its length like Radio packets"""
+    counters = restart_counter.to_bytes(3, "big") + message_counter.to_bytes(3, "big")
+    frame_len = 7 + len(data) + 23
+    header = bytes([frame_len, Frame.SECURE_FRAME_TYPE, (seq_num << 4) | 4])
+    header += trv_id[:4] + bytes([len(data)])
+    encrypted = AESGCM(key).encrypt(trv_id[:6] + counters, data, header)
+    return header + encrypted[:-16] + counters + encrypted[-16:] + b"\x80"
+
+
+def current_rss_bytes():
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # Peak rather than current, but the best available without procfs
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+class SoakFinished(Exception):
+    pass
+
+
+class SimulatedTRV:
+    def __init__(self, index, key, rng):
+        self.name = f"sim-{index:04d}"
+        self.id = (0x5A000000 + index).to_bytes(4, "big") + bytes(
+            rng.getrandbits(8) for _ in range(4)
+        )
+        self.key = key
+        self.rng = rng
+        self.restart_counter = rng.randrange(1, 100)
+        # Start well above 1000 so the first message isn't judged to follow skipped ones
+        self.message_counter = rng.randrange(2000, 100000)
+        self.rssi = rng.uniform(-95, -45)
+        self.room_temp = rng.uniform(14.0, 23.0)
+        self.valve_total = rng.randrange(0, 5000)
+        self.seq_num = 0
+
+        # Updated as packets come out of the simulated radio, for checking metrics at the end
+        self.delivered = 0
+        self.expected_skipped = 0
+        self.last_delivered_counter = -1000
+        self.last_delivered_temp = None
+
+    def next_packet(self, gap_rate, restart_rate):
+        if self.rng.random() < restart_rate:
+            self.restart_counter += 1
+            self.message_counter = 0
+        elif self.rng.random() < gap_rate:
+            # Messages lost over the air, never reaching the radio
+            self.message_counter += self.rng.randrange(1, 4)
+        self.message_counter += 1
+        self.seq_num = (self.seq_num + 1) & 0x0F
+
+        self.room_temp += self.rng.uniform(-0.2, 0.2)
+        valve_open = self.rng.randrange(0, 101)
+        self.valve_total += valve_open // 10
+        room_temp_c16 = int(self.room_temp * 16)
+        # TRVs truncate the JSON object, leaving off the final "}"
+        stats_json = (
+            f'{{"T|C16":{room_temp_c16},"B|cV":{self.rng.randrange(250, 310)},'
+            f'"vC|%":{self.valve_total},"O":{self.rng.randrange(0, 4)}'
+        )
+        flags = 0x10  # Stats present
+        data = bytes([valve_open, flags]) + stats_json.encode("utf-8") + b"\x00"
+        packet = encode_secure_frame(
+            self.id, self.key, self.restart_counter, self.message_counter, data, self.seq_num
+        )
+        rssi = round(self.rssi + self.rng.gauss(0, 3))
+        return packet, rssi, (self.message_counter, room_temp_c16 / 16.0)
+
+    def record_delivery(self, message_counter, room_temp):
+        # Same rule as parse_stats: a forward jump in the counter means skipped messages
+        diff = (message_counter - self.last_delivered_counter) - 1
+        if 0 < diff < 1000:
+            self.expected_skipped += diff
+        self.last_delivered_counter = message_counter
+        self.last_delivered_temp = room_temp
+        self.delivered += 1
+
+
+class SimulatedFleet:
+    """Every TRV sending on its own jittered schedule, heard by all the simulated radios"""
+
+    def __init__(
+        self,
+        trvs,
+        rng,
+        interval=DEFAULT_INTERVAL,
+        jitter=0.1,
+        gap_rate=0.02,
+        restart_rate=0.001,
+        speedup=1.0,
+    ):
+        self.trvs = trvs
+        self.rng = rng
+        self.interval = interval
+        self.jitter = jitter
+        self.gap_rate = gap_rate
+        self.restart_rate = restart_rate
+        self.speedup = speedup
+        self.receivers = []
+        self.ingest = None
+        # Packet to (trv, expected values, time sent) until it comes out of the ingest queue
+        self.pending = {}
+        self.generated = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="simulated-fleet", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def _run(self):
+        start = time.monotonic()
+        schedule = [(self.rng.uniform(0, self.interval), i) for i in range(len(self.trvs))]
+        heapq.heapify(schedule)
+        while schedule:
+            sim_time, index = heapq.heappop(schedule)
+            delay = start + sim_time / self.speedup - time.monotonic()
+            if self._stop.wait(max(0.0, delay)):
+                return
+            trv = self.trvs[index]
+            packet, rssi, expected = trv.next_packet(self.gap_rate, self.restart_rate)
+            self.generated += 1
+            self.pending[packet] = (trv, expected, time.monotonic())
+            self.ingest.last_accepted = False
+            for rfm69 in self.receivers:
+                # Radios take the frame without the length byte, like a real FIFO
+                rfm69.receive(packet[1:], rssi)
+            if not self.ingest.last_accepted:
+                self.pending.pop(packet, None)
+            next_time = sim_time + self.interval * self.rng.uniform(
+                1 - self.jitter, 1 + self.jitter
+            )
+            heapq.heappush(schedule, (next_time, index))
+
+
+class SimulatedIngest(PacketIngest):
+    """The real ingest queue, timing how long gather_stats takes over each packet"""
+
+    def __init__(self, fleet, duration):
+        super().__init__()
+        self._fleet = fleet
+        self._deadline = time.monotonic() + duration
+        self._current = None
+        self._rng = random.Random(0)
+        self.last_accepted = False
+        self.processed = 0
+        self.latencies = []
+
+    def put(self, packet, rssi, receiver_id, timeout=1):
+        accepted = super().put(packet, rssi, receiver_id, timeout)
+        self.last_accepted |= accepted
+        return accepted
+
+    def _record_latency(self, latency):
+        # Reservoir sample so memory stays flat on long runs
+        if len(self.latencies) < MAX_LATENCY_SAMPLES:
+            self.latencies.append(latency)
+        else:
+            i = self._rng.randrange(self.processed)
+            if i < MAX_LATENCY_SAMPLES:
+                self.latencies[i] = latency
+
+    def wait_for_packet_queue(self, timeout=60.0):
+        if self._fleet.ingest is None:
+            # Radios are all set up by the first wait
+            self._fleet.ingest = self
+            self._fleet.start()
+        now = time.monotonic()
+        if self._current is not None:
+            trv, expected, sent = self._current
+            self.processed += 1
+            self._record_latency(now - sent)
+            trv.record_delivery(*expected)
+            self._current = None
+
+        remaining = self._deadline - now
+        if remaining <= 0:
+            raise SoakFinished()
+        packet, rssi, receiver_id = super().wait_for_packet_queue(min(timeout, remaining))
+        if packet is not None:
+            self._current = self._fleet.pending.pop(bytes(packet))
+        return packet, rssi, receiver_id
+
+
+class SimulatedDisplay:
+    def __init__(self):
+        self.lines = []
+
+    def clear(self, display=True):
+        self.lines = []
+
+    def append_line(self, text):
+        self.lines.append(text)
+
+    def set_line(self, line_num, text):
+        while len(self.lines) <= line_num:
+            self.lines.append("")
+        self.lines[line_num] = text
+
+    def show_lines(self):
+        pass
+
+
+class SimulatedHardware:
+    def __init__(self, fleet, duration):
+        self.fleet = fleet
+        self.duration = duration
+        self.backend = FakeRadioBackend()
+        self.simulated_ingest = None
+
+    def ingest(self):
+        self.simulated_ingest = SimulatedIngest(self.fleet, self.duration)
+        return self.simulated_ingest
+
+    def radio(self, config, ingest):
+        radio = Radio(config, ingest, backend=self.backend)
+        self.fleet.receivers.append(self.backend.rfm69s[config.id])
+        return radio
+
+    def display(self):
+        return SimulatedDisplay()
+
+    def cleanup(self):
+        self.fleet.stop()
+
+
+def check_metrics(trvs):
+    mismatches = []
+    for trv in trvs:
+        received = stats.SUCCESSFUL_MESSAGES.labels(trv.name)._value.get()
+        if received != trv.delivered:
+            mismatches.append(f"{trv.name}: messages_received {received} != {trv.delivered}")
+        skipped = stats.SKIPPED_MESSAGES.labels(trv.name)._value.get()
+        if skipped != trv.expected_skipped:
+            mismatches.append(f"{trv.name}: messages_missed {skipped} != {trv.expected_skipped}")
+        if trv.name in stats.TRV_LAST_REPORT_TIME and trv.last_delivered_temp is not None:
+            temp = stats.ROOM_TEMP.labels(trv.name)._value.get()
+            if abs(temp - trv.last_delivered_temp) > 1e-9:
+                mismatches.append(
+                    f"{trv.name}: room_temperature {temp} != {trv.last_delivered_temp}"
+                )
+    return mismatches
+
+
+def run_soak(
+    num_trvs=20,
+    duration=60.0,
+    interval=DEFAULT_INTERVAL,
+    jitter=0.1,
+    gap_rate=0.02,
+    restart_rate=0.001,
+    speedup=1.0,
+    receivers=1,
+    seed=1,
+):
+    rng = random.Random(seed)
+    key = bytes(rng.getrandbits(8) for _ in range(16))
+    trvs = [SimulatedTRV(i, key, rng) for i in range(num_trvs)]
+
+    with tempfile.NamedTemporaryFile("w", suffix=".yaml", delete=False) as f:
+        f.write("trvs:\n")
+        for trv in trvs:
+            f.write(f"  - id: {trv.id.hex()}\n    name: {trv.name}\n")
+        f.write(f"secure_key: {key.hex()}\n")
+        # Every radio hears every packet, so all but the first copy are dropped as duplicates
+        f.write("radios:\n")
+        for i in range(receivers):
+            f.write(f"  - id: radio{i}\n    dio0: {22 + i}\n")
+        config_path = f.name
+    try:
+        fleet = SimulatedFleet(trvs, rng, interval, jitter, gap_rate, restart_rate, speedup=speedup)
+        hardware = SimulatedHardware(fleet, duration)
+        system = System(config_path, hardware=hardware)
+    finally:
+        os.remove(config_path)
+
+    dropped_start = stats.PACKETS_DROPPED._value.get()
+    rss_start = current_rss_bytes()
+    start = time.monotonic()
+    try:
+        system.gather_stats()
+    except SoakFinished:
+        pass
+    elapsed = time.monotonic() - start
+    rss_end = current_rss_bytes()
+
+    ingest = hardware.simulated_ingest
+    latencies = sorted(ingest.latencies)
+    return {
+        "trvs": num_trvs,
+        "receivers": receivers,
+        "elapsed_seconds": elapsed,
+        "generated": fleet.generated,
+        "processed": ingest.processed,
+        "queue_drops": int(stats.PACKETS_DROPPED._value.get() - dropped_start),
+        "throughput_per_second": ingest.processed / elapsed,
+        "latency_p50_ms": percentile(latencies, 0.50) * 1000,
+        "latency_p99_ms": percentile(latencies, 0.99) * 1000,
+        "rss_start_bytes": rss_start,
+        "rss_end_bytes": rss_end,
+        "rss_growth_bytes": rss_end - rss_start,
+        "metric_mismatches": check_metrics(trvs),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--trvs", type=int, default=20, help="Number of simulated TRVs")
+    parser.add_argument("--duration", type=float, default=60.0, help="Run time in seconds")
+    parser.add_argument(
+        "--interval", type=float, default=DEFAULT_INTERVAL, help="Seconds between TRV messages"
+    )
+    parser.add_argument("--jitter", type=float, default=0.1, help="Fractional interval jitter")
+    parser.add_argument("--gap-rate", type=float, default=0.02, help="Chance of lost messages")
+    parser.add_argument("--restart-rate", type=float, default=0.001, help="Chance of restart")
+    parser.add_argument(
+        "--speedup", type=float, default=1.0, help="Run the simulated fleet this much faster"
+    )
+    parser.add_argument("--receivers", type=int, default=1, help="Number of simulated radios")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level)
+    report = run_soak(
+        num_trvs=args.trvs,
+        duration=args.duration,
+        interval=args.interval,
+        jitter=args.jitter,
+        gap_rate=args.gap_rate,
+        restart_rate=args.restart_rate,
+        speedup=args.speedup,
+        receivers=args.receivers,
+        seed=args.seed,
+    )
+    mismatches = report.pop("metric_mismatches")
+    for name, value in report.items():
+        print(f"{name:24} {value:.3f}" if isinstance(value, float) else f"{name:24} {value}")
+    print(f"{'metric_mismatches':24} {len(mismatches)}")
+    for mismatch in mismatches:
+        print(f"  {mismatch}")
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -12,17 +12,41 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import json
 import logging
+import re
+import sys
 import time
+from collections import OrderedDict
+from itertools import chain
 
 from prometheus_client import Counter, Gauge
 
+from .sketch import QuantileSketch
+
+logger = logging.getLogger(__name__)
+
 RECENT_REPORTING_TRVS = Gauge(
     "recent_reporting_trv_count",
     "Number of TRVs that were reporting in the last 10 minutes",
 )
 
+# Split per radio receiver by its configured id
+RECEIVER_PACKETS = Counter(
+    "receiver_packets", "Packets received by each radio, including duplicates", ["receiver"]
+)
+RECEIVER_DUPLICATES = Counter(
+    "receiver_duplicate_packets",
+    "Packets dropped as already received by another radio",
+    ["receiver"],
+)
+PACKETS_DROPPED = Counter("packets_dropped", "Packets dropped as the processing queue was full")
+RECEIVER_RSSI = Gauge(
+    "receiver_rssi",
+    "Received Signal Strength Indicator of each radio's last packet in dBm",
+    unit="dbm",
+    labelnames=["receiver"],
+)
+
 # Unless explicitly mentioned, all below metrics are labelled/split per TRV by TRV name
 std_lables = ["trv"]
 
@@ -114,6 +138,21 @@ SETBACK_LOCKOUT = Gauge("setback_lockout", "???", labelnames=std_lables)
 ERROR_REPORT = Gauge("error_report", "???", labelnames=std_lables)
 RESET_COUNTER = Gauge("reset_counter", "???", labelnames=std_lables)
 
+# Distributions over all messages since the TRV was first heard, from a fixed size sketch per TRV
+QUANTILES = [0.1, 0.5, 0.9]
+RADIO_RSSI_QUANTILE = Gauge(
+    "radio_rssi_quantile",
+    "Quantiles of Received Signal Strength Indicator in decibel-milliwatts (dBm)",
+    unit="dbm",
+    labelnames=std_lables + ["quantile"],
+)
+MESSAGE_INTERVAL_QUANTILE = Gauge(
+    "message_interval_quantile",
+    "Quantiles of time between successful messages",
+    unit="seconds",
+    labelnames=std_lables + ["quantile"],
+)
+
 
 JSON_STAT_TO_METRIC = {
     "B|cV": BATTERY_VOLTAGE,
@@ -134,9 +173,61 @@ JSON_STAT_TO_METRIC = {
 # Divisors to convert TRV scales or Light level to Prometheus standard base units
 UNIT_FACTOR = {"%": 100.0, "C16": 16.0, "cV": 100.0, "L": 255.0, "h": 1.0 / 3600}
 
-TRV_LAST_MESSAGE_COUNTER = {}
+
+def _compact_stat_divisor(json_stat):
+    divisor = UNIT_FACTOR.get(json_stat, 1.0)
+    if "|" in json_stat:
+        divisor *= UNIT_FACTOR.get(json_stat.split("|")[1], 1.0)
+    return divisor
+
+
+# Exported names of the metrics set from compact stats, e.g. for the event feed
+COMPACT_STAT_METRIC_NAMES = {
+    metric: metric.describe()[0].name for metric in JSON_STAT_TO_METRIC.values() if metric
+}
+# Known stats keyed by their raw bytes, so the stats payload needn't be decoded to look them up
+COMPACT_STATS = {
+    json_stat.encode("utf-8"): (json_stat, metric, _compact_stat_divisor(json_stat))
+    for json_stat, metric in JSON_STAT_TO_METRIC.items()
+}
+# Only integer values are reported, anything else (or a partial "key":value) is skipped
+COMPACT_STAT_PATTERN = re.compile(rb'"([^"]{1,16})":(-?[0-9]+)(?=[,}\s]|$)')
+# Without a NUL terminator the last value may have been cut short, so it must be followed by more
+UNTERMINATED_COMPACT_STAT_PATTERN = re.compile(rb'"([^"]{1,16})":(-?[0-9]+)(?=[,}\s])')
+
+
+def iter_compact_stats(stats, terminated=True):
+    """Yield (json_stat, metric, value) from the flat stats JSON sent by a TRV
+
+    Works on the raw (and usually truncated) bytes in a single pass, never raising on malformed
+    input. Known stats are scaled to base units, metric being None for ones deliberately not
+    exported. Unknown stats get metric "" and their value unscaled. Unless terminated, i.e. the
+    TRV's NUL terminator was seen, a value running to the end of stats is skipped as incomplete.
+    """
+    pattern = COMPACT_STAT_PATTERN if terminated else UNTERMINATED_COMPACT_STAT_PATTERN
+    for match in pattern.finditer(stats):
+        known = COMPACT_STATS.get(match.group(1))
+        if known is None:
+            yield match.group(1).decode("utf-8", errors="replace"), "", int(match.group(2))
+        else:
+            json_stat, metric, divisor = known
+            yield json_stat, metric, int(match.group(2)) / divisor
+
+
+TRV_STATE_MEMORY = Gauge(
+    "trv_state_memory",
+    "Approximate memory used by per-TRV state and metric children",
+    unit="bytes",
+)
+
+# Kept in least- to most-recently reported order so the oldest TRVs can be evicted first
+TRV_LAST_MESSAGE_COUNTER = OrderedDict()
 TRV_LAST_REPORT_TIME = {}
 RECENT_MESSAGE_MAX_AGE = 600
+# None for no cap
+MAX_TRACKED_TRVS = None
+# Measured cost of one labelled Gauge/Counter child in prometheus_client, plus its label tuple
+APPROX_BYTES_PER_METRIC_CHILD = 700
 
 DROP_WHEN_MISSING = [
     RADIO_RSSI,
@@ -158,10 +249,81 @@ DROP_WHEN_MISSING = [
     SETBACK_TEMP,
     SETBACK_LOCKOUT,
     ERROR_REPORT,
-    VALVE_OPEN,
     RESET_COUNTER,
 ]
 
+# Every metric family labelled by TRV name, forgotten when a TRV is evicted
+PER_TRV_METRICS = [SUCCESSFUL_MESSAGES, SKIPPED_MESSAGES, LAST_REPORT_TIME] + DROP_WHEN_MISSING
+PER_TRV_QUANTILE_METRICS = [RADIO_RSSI_QUANTILE, MESSAGE_INTERVAL_QUANTILE]
+
+
+class LinkStats:
+    def __init__(self):
+        # RSSI is negative so sketched as its positive negation
+        self.negative_rssi = QuantileSketch()
+        self.interval = QuantileSketch()
+        self.last_time = None
+
+    def add(self, rssi, now):
+        self.negative_rssi.add(-rssi)
+        if self.last_time is not None:
+            self.interval.add(now - self.last_time)
+        self.last_time = now
+
+    def approx_bytes(self):
+        return self.negative_rssi.approx_bytes() + self.interval.approx_bytes()
+
+
+TRV_LINK_STATS = {}
+
+
+def set_max_tracked_trvs(max_trvs):
+    global MAX_TRACKED_TRVS
+    if max_trvs is not None and max_trvs < 1:
+        raise ValueError(f"max_tracked_trvs should be at least 1, not {max_trvs}")
+    MAX_TRACKED_TRVS = max_trvs
+    evict_least_recent_trvs()
+
+
+def remove_quantiles(trv):
+    for metric in PER_TRV_QUANTILE_METRICS:
+        for quantile in QUANTILES:
+            try:
+                metric.remove(trv, str(quantile))
+            except KeyError:
+                pass
+
+
+def forget_trv(trv):
+    for metric in PER_TRV_METRICS:
+        try:
+            metric.remove(trv)
+        except KeyError:
+            pass
+    remove_quantiles(trv)
+    TRV_LAST_MESSAGE_COUNTER.pop(trv, None)
+    TRV_LAST_REPORT_TIME.pop(trv, None)
+    TRV_LINK_STATS.pop(trv, None)
+
+
+def evict_least_recent_trvs():
+    while MAX_TRACKED_TRVS is not None and len(TRV_LAST_MESSAGE_COUNTER) > MAX_TRACKED_TRVS:
+        trv = next(iter(TRV_LAST_MESSAGE_COUNTER))
+        logger.warning("Tracking more than %d TRVs, evicting: %s", MAX_TRACKED_TRVS, trv)
+        forget_trv(trv)
+    RECENT_REPORTING_TRVS.set(len(TRV_LAST_REPORT_TIME))
+    TRV_STATE_MEMORY.set(approx_trv_state_bytes())
+
+
+def approx_trv_state_bytes():
+    total = sys.getsizeof(TRV_LAST_MESSAGE_COUNTER) + sys.getsizeof(TRV_LAST_REPORT_TIME)
+    total += sum(sys.getsizeof(trv) for trv in TRV_LAST_MESSAGE_COUNTER)
+    total += sum(link_stats.approx_bytes() for link_stats in TRV_LINK_STATS.values())
+    num_children = sum(
+        len(metric._metrics) for metric in PER_TRV_METRICS + PER_TRV_QUANTILE_METRICS
+    )
+    return total + num_children * APPROX_BYTES_PER_METRIC_CHILD
+
 
 def recalc_recent_trv_count(now):
     to_remove = list(
@@ -172,18 +334,67 @@ def recalc_recent_trv_count(now):
         )
     )
     for trv in to_remove:
-        logging.info(f"Dropping metrics for missing trv: {trv}")
+        logger.info("Dropping metrics for missing trv: %s", trv)
         for metric in DROP_WHEN_MISSING:
             try:
                 metric.remove(trv)
             except KeyError:
                 pass
+        # Link stats are kept to carry on from if it's heard again, but not exported meanwhile
+        remove_quantiles(trv)
         TRV_LAST_REPORT_TIME.pop(trv)
     num_recent = len(TRV_LAST_REPORT_TIME)
     RECENT_REPORTING_TRVS.set(num_recent)
     return num_recent
 
 
+def iter_frame_stats(frame):
+    """Yield (metric, value) for every gauge set purely from the contents of a frame"""
+    yield from iter_frame_flags(frame)
+    yield from iter_frame_compact_stats(frame)
+
+
+def iter_frame_flags(frame):
+    if frame.valve_open_percent is not None:
+        yield VALVE_OPEN, frame.valve_open_percent / 100.0
+    yield CALL_FOR_HEAT, frame.call_for_heat
+    yield FAULT, frame.fault
+    yield BATTERY_LOW, frame.battery_low
+    yield TAMPER, frame.tamper
+    yield OCCUPANCY1, frame.occupancy
+    yield FROST_RISK, frame.frost_risk
+
+
+def iter_frame_compact_stats(frame):
+    for json_stat, metric, value in iter_compact_stats(frame.stats, frame.stats_terminated):
+        if not metric:
+            if metric == "":
+                logger.warning(
+                    "Unknown JSON stat: %s from trv %s",
+                    json_stat,
+                    frame.trv_name,
+                    extra={"trv": frame.trv_name},
+                )
+            continue
+        yield metric, value
+
+
+def update_link_stats(trv_name, rssi, now):
+    link_stats = TRV_LINK_STATS.get(trv_name)
+    if link_stats is None:
+        link_stats = TRV_LINK_STATS[trv_name] = LinkStats()
+    link_stats.add(rssi, now)
+    for quantile in QUANTILES:
+        label = str(quantile)
+        # Low RSSI quantiles are the high quantiles of its negation
+        RADIO_RSSI_QUANTILE.labels(trv_name, label).set(
+            -link_stats.negative_rssi.quantile(1 - quantile)
+        )
+        interval = link_stats.interval.quantile(quantile)
+        if interval is not None:
+            MESSAGE_INTERVAL_QUANTILE.labels(trv_name, label).set(interval)
+
+
 def parse_stats(frame, rssi):
     trv_name = frame.trv_name
 
@@ -195,56 +406,43 @@ def parse_stats(frame, rssi):
     if diff > 0 and diff < 1000:
         SKIPPED_MESSAGES.labels(trv_name).inc(diff)
     TRV_LAST_MESSAGE_COUNTER[trv_name] = frame.message_counter
+    TRV_LAST_MESSAGE_COUNTER.move_to_end(trv_name)
 
     now = time.time()
     TRV_LAST_REPORT_TIME[trv_name] = now
     LAST_REPORT_TIME.labels(trv_name).set(now)
     recalc_recent_trv_count(now)
+    update_link_stats(trv_name, rssi, now)
 
     if frame.valve_open_percent is None:
         try:
             VALVE_OPEN.remove(trv_name)
         except KeyError:
             pass
-    else:
-        VALVE_OPEN.labels(trv_name).set(frame.valve_open_percent / 100.0)
-
-    CALL_FOR_HEAT.labels(trv_name).set(frame.call_for_heat)
-    FAULT.labels(trv_name).set(frame.fault)
-    BATTERY_LOW.labels(trv_name).set(frame.battery_low)
-    TAMPER.labels(trv_name).set(frame.tamper)
-    OCCUPANCY1.labels(trv_name).set(frame.occupancy)
-    FROST_RISK.labels(trv_name).set(frame.frost_risk)
-
-    for json_stat, value in json.loads(frame.json_text).items():
-        metric = JSON_STAT_TO_METRIC.get(json_stat, "")
-        if not metric:
-            if metric == "":
-                logging.warning(f"Unknown JSON stat: {json_stat} from trv {trv_name}")
-            continue
-        if "|" in json_stat:
-            unit = json_stat.split("|")[1]
-            value /= UNIT_FACTOR.get(unit, 1.0)
-        value /= UNIT_FACTOR.get(json_stat, 1.0)
+    compact_stats = list(iter_frame_compact_stats(frame))
+    for metric, value in chain(iter_frame_flags(frame), compact_stats):
         metric.labels(trv_name).set(value)
 
+    evict_least_recent_trvs()
+    return compact_stats
+
 
 def get_stat_summaries():
     # Summary across all TRVs
     min_room_temp = 50
     max_room_temp = 0
-    for _, _, value, _, _ in ROOM_TEMP._samples():
-        min_room_temp = min(min_room_temp, value)
-        max_room_temp = max(max_room_temp, value)
+    for sample in ROOM_TEMP._samples():
+        min_room_temp = min(min_room_temp, sample.value)
+        max_room_temp = max(max_room_temp, sample.value)
     temp_summary = "Waiting for room temps..."
     if min_room_temp < 50:
         temp_summary = f"Temps: {min_room_temp:.1f} - {max_room_temp:.1f}"
     min_battery = min(
-        (value for _, _, value, _, _ in BATTERY_VOLTAGE._samples()),
+        (sample.value for sample in BATTERY_VOLTAGE._samples()),
         default="...",
     )
     max_valve = max(
-        (int(value * 100) for _, _, value, _, _ in VALVE_OPEN._samples()),
+        (int(sample.value * 100) for sample in VALVE_OPEN._samples()),
         default="...",
     )
     battery_valve_summary = f"Bmin {min_battery}V, Vmax {max_valve}%"
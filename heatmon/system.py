@@ -16,13 +16,22 @@ import logging
 import sys
 import time
 
-import RPi.GPIO as GPIO
 from ruamel.yaml import YAML
 
-from .display import Display
+from .capture import PacketCapture
 from .frame import Frame
-from .radio import Radio
-from .stats import get_stat_summaries, parse_stats, recalc_recent_trv_count
+from .logs import apply_config_levels
+from .radio import PacketIngest, Radio, RadioConfig
+from .stats import get_stat_summaries, parse_stats, recalc_recent_trv_count, set_max_tracked_trvs
+
+logger = logging.getLogger(__name__)
+
+
+def parse_secure_key(text, description="secure_key"):
+    key = bytes.fromhex(text)
+    if len(key) != 16:
+        raise ValueError(f"Config bad length: {description} should be 16 bytes long")
+    return key
 
 
 class TRV:
@@ -32,16 +41,51 @@ class TRV:
             self.name = config["name"]
         except KeyError as e:
             raise ValueError(f"Missing id/name attribute for trv in '{config}'!") from e
+        # Optional per-TRV keys, falling back to the global secure_key
+        self.secure_key = None
+        if "secure_key" in config:
+            self.secure_key = parse_secure_key(config["secure_key"], f"{self.name} secure_key")
+        # Only set while rotating a TRV to a new key, to accept its packets with either
+        self.previous_secure_key = None
+        if "previous_secure_key" in config:
+            self.previous_secure_key = parse_secure_key(
+                config["previous_secure_key"], f"{self.name} previous_secure_key"
+            )
+
+
+class PiHardware:
+    """Real radios & display, only importing their libraries when used on a Raspberry Pi"""
+
+    def ingest(self):
+        return PacketIngest()
+
+    def radio(self, config, ingest):
+        return Radio(config, ingest)
+
+    def display(self):
+        from .display import Display
+
+        return Display()
+
+    def cleanup(self):
+        import RPi.GPIO as GPIO
+
+        GPIO.cleanup()
 
 
 class System:
-    def __init__(self, config_path="./heatmon.yaml"):
+    def __init__(self, config_path="./heatmon.yaml", hardware=None, feed=None):
+        self.hardware = hardware or PiHardware()
+        self.feed = feed
         self.display = None
-        self.radio = None
+        self.ingest = None
+        self.radios = []
+        self.capture = None
 
         with open(config_path, "r") as f:
             yaml = YAML(typ="safe")
             yaml_config = yaml.load(f)
+        apply_config_levels(yaml_config.get("logging") or {})
         self.trvs_by_id = {}
         if "trvs" not in yaml_config:
             raise ValueError(
@@ -50,40 +94,80 @@ class System:
         for config in yaml_config["trvs"]:
             trv = TRV(config)
             self.trvs_by_id[trv.id] = trv
-        Frame.register_known_trvs(self.trvs_by_id.values())
         if "secure_key" not in yaml_config:
             raise ValueError(
                 "Config missing: secure_key (the 16-byte hex key use to reprogram the TRVs)"
             )
-        self.key = bytes.fromhex(yaml_config["secure_key"])
-        if len(self.key) != 16:
-            raise ValueError("Config bad length: secure_key should be 16 bytes long")
+        self.key = parse_secure_key(yaml_config["secure_key"])
+        # Before the TRVs, as those rotating to the global key keep a reference to its decryptor
         Frame.register_secure_key(self.key)
+        Frame.register_known_trvs(self.trvs_by_id.values())
+        if "max_tracked_trvs" in yaml_config:
+            max_tracked_trvs = int(yaml_config["max_tracked_trvs"])
+            # Only configured TRVs can be decrypted, so a lower cap would keep evicting them
+            if max_tracked_trvs < len(self.trvs_by_id):
+                raise ValueError(
+                    f"Config max_tracked_trvs: {max_tracked_trvs} is less than the "
+                    f"{len(self.trvs_by_id)} TRVs configured"
+                )
+            set_max_tracked_trvs(max_tracked_trvs)
+        radios = yaml_config.get("radios")
+        if radios is None:
+            radios = [{}]
+        elif not radios:
+            raise ValueError(
+                "Config radios: needs at least one radio, or leave out for the default"
+            )
+        self.radio_configs = [RadioConfig(config) for config in radios]
+        radio_ids = [config.id for config in self.radio_configs]
+        if len(set(radio_ids)) != len(radio_ids):
+            raise ValueError(f"Config radios: each radio needs a different id, not {radio_ids}")
+        # Optionally keep every raw packet, e.g. for backfilling metrics after an outage
+        self.packet_capture_path = yaml_config.get("packet_capture")
+        self.packet_capture_max_bytes = int(yaml_config.get("packet_capture_max_bytes", 8 << 20))
+        self.packet_capture_backups = int(yaml_config.get("packet_capture_backups", 7))
 
     def gather_stats(self):
         try:
-            self.display = Display()
+            self.display = self.hardware.display()
             self.display.clear()
             self.display.set_line(0, "Heatmon starting...")
             self.display.show_lines()
 
-            self.radio = Radio()
+            self.ingest = self.hardware.ingest()
+            for config in self.radio_configs:
+                self.radios.append(self.hardware.radio(config, self.ingest))
+            if self.packet_capture_path:
+                self.capture = PacketCapture(
+                    self.packet_capture_path,
+                    max_bytes=self.packet_capture_max_bytes,
+                    backups=self.packet_capture_backups,
+                )
 
             self.display.set_line(0, "Heatmon started")
             self.display.show_lines()
-            logging.info("Heatmon system starting to gather_stats")
+            logger.info("Heatmon system starting to gather_stats")
 
             last_report_time = "never"
             while True:
-                packet, rssi = self.radio.wait_for_packet_queue()
+                packet, rssi, receiver_id = self.ingest.wait_for_packet_queue()
+                if self.capture and packet:
+                    self.capture.write(time.time(), rssi, packet)
                 frame = Frame(packet)
                 if frame.semi_ok():
-                    logging.info(f"Packet: {frame.one_line_summary()}")
+                    logger.info("Packet: %s", frame, extra={"trv": frame.trv_name})
                     # frame.debug()
                 now = time.time()
-                if not frame.corrupt and frame.json_text:
-                    parse_stats(frame, rssi)
-                    logging.info(f"RSSI {rssi} dBm")
+                if not frame.corrupt and frame.stats:
+                    compact_stats = parse_stats(frame, rssi)
+                    if self.feed:
+                        self.feed.publish_frame(frame, rssi, now, receiver_id, compact_stats)
+                    logger.info(
+                        "RSSI %s dBm via %s",
+                        rssi,
+                        receiver_id,
+                        extra={"trv": frame.trv_name, "rssi": rssi, "receiver": receiver_id},
+                    )
                     last_report_time = time.strftime("%H:%M", time.localtime(now))
                 num_recent = recalc_recent_trv_count(now)
 
@@ -93,9 +177,11 @@ class System:
                 self.display.set_line(2, battery_valve_summary)
                 self.display.show_lines()
         finally:
-            if self.radio:
-                self.radio.reset()
-                print("Radio reset.", file=sys.stderr, flush=True)
+            for radio in self.radios:
+                radio.reset()
+                print(f"Radio {radio.config.id} reset.", file=sys.stderr, flush=True)
             if self.display:
                 self.display.clear()
-            GPIO.cleanup()
+            if self.capture:
+                self.capture.close()
+            self.hardware.cleanup()
@@ -33,6 +33,8 @@ setup(
     entry_points="""
         [console_scripts]
         heatmon=heatmon.main:main
+        heatmon_soak=heatmon.soak:main
+        heatmon_backfill=heatmon.backfill:main
         set_trv_key=set_trv_key:main
     """,
 )
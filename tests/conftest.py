@@ -0,0 +1,41 @@
+from types import SimpleNamespace
+
+import pytest
+
+from heatmon.frame import Frame
+
+
+@pytest.fixture
+def clean_frame(monkeypatch):
+    """Frame's known TRVs & keys as before anything was registered, restored afterwards"""
+    monkeypatch.setattr(Frame, "KNOWN_TRV_IDS_TO_NAMES", {})
+    monkeypatch.setattr(Frame, "KNOWN_TRV_IDS_TO_DECRYPTORS", {})
+    monkeypatch.setattr(Frame, "DECRYPTORS_BY_KEY", {})
+    monkeypatch.setattr(Frame, "DECRYPTOR", None)
+
+
+def _make_frame(
+    trv_name="bedroom", message_counter=5000, stats=b'{"T|C16":320,"B|cV":254', **fields
+):
+    frame = SimpleNamespace(
+        trv_name=trv_name,
+        restart_counter=3,
+        message_counter=message_counter,
+        valve_open_percent=25,
+        call_for_heat=True,
+        fault=False,
+        battery_low=False,
+        tamper=False,
+        occupancy=0,
+        frost_risk=False,
+        stats=stats,
+        stats_terminated=True,
+    )
+    vars(frame).update(fields)
+    return frame
+
+
+@pytest.fixture
+def make_frame():
+    """Builds stand-ins for decoded Frames, as read by parse_stats and the event feed"""
+    return _make_frame
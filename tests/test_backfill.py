@@ -0,0 +1,62 @@
+import io
+
+from heatmon.backfill import OpenMetricsWriter, backfill
+from heatmon.capture import PacketCapture, capture_files
+from heatmon.soak import encode_secure_frame
+from heatmon.system import System
+
+KEY = bytes(range(16))
+TRV_ID = bytes.fromhex("f001020304050607")
+OPEN_TRV_ID = bytes.fromhex("8081020304050607")
+# Open frame from OPEN_TRV_ID, which Frame refuses to decode
+OPEN_PACKET = b"\x08\x4f\x02\x80\x81\x02\x00\x01\x23"
+
+
+def test_backfill(tmp_path, clean_frame):
+    config = tmp_path / "heatmon.yaml"
+    config.write_text(
+        f"trvs:\n  - id: {TRV_ID.hex(' ')}\n    name: bedroom\n"
+        f"  - id: {OPEN_TRV_ID.hex(' ')}\n    name: hall\nsecure_key: {KEY.hex()}\n"
+    )
+    System(str(config))
+
+    lines = ["# captured\n"]
+    for i, temp_c16 in enumerate([320, 328]):
+        data = b'\x19\x10{"T|C16":' + str(temp_c16).encode() + b"\x00"
+        packet = encode_secure_frame(TRV_ID, KEY, 1, 100 + i, data)
+        lines.append(f"{1600000000 + 240 * i} -70 {packet.hex()}\n")
+    # Duplicate, unreadable and undecodable lines are skipped
+    lines.append(lines[-1])
+    lines.append("not a packet\n")
+    lines.append(f"1600000500 -70 {OPEN_PACKET.hex()}\n")
+
+    writer = OpenMetricsWriter()
+    assert backfill(lines, writer) == 2
+    out = io.StringIO()
+    writer.write(out)
+    text = out.getvalue()
+
+    assert text.endswith("# EOF\n")
+    assert (
+        "# TYPE room_temperature_celsius gauge\n"
+        "# UNIT room_temperature_celsius celsius\n"
+        "# HELP room_temperature_celsius Room temperature in Celsius\n"
+        'room_temperature_celsius{trv="bedroom"} 20.0 1600000000.0\n'
+        'room_temperature_celsius{trv="bedroom"} 20.5 1600000240.0\n'
+    ) in text
+    assert 'valve_open_ratio{trv="bedroom"} 0.25 1600000240.0\n' in text
+    assert text.count("# TYPE radio_rssi_dbm gauge\n") == 1
+
+
+def test_capture_rotation(tmp_path):
+    path = str(tmp_path / "packets.log")
+    # Room for two 24 byte lines per file, so the oldest file with the first two is dropped
+    capture = PacketCapture(path, max_bytes=50, backups=2)
+    for i in range(7):
+        capture.write(1600000000 + i, -70, b"\x08\x4f")
+    capture.close()
+
+    files = capture_files(path)
+    assert files == [path + ".2", path + ".1", path]
+    timestamps = [line.split()[0] for f in files for line in open(f)]
+    assert timestamps == [f"{1600000000 + i}.000" for i in range(2, 7)]
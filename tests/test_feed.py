@@ -0,0 +1,61 @@
+import json
+import time
+from http.client import HTTPConnection
+
+from heatmon import stats
+from heatmon.feed import EventFeed
+
+
+def read_events(message):
+    assert message.endswith(b"\n\n")
+    return [json.loads(line[len("data: ") :]) for line in message.decode().strip().split("\n")]
+
+
+def test_frames_and_changes_batched(make_frame):
+    feed = EventFeed()
+    subscriber = feed.subscribe()
+    compact_stats = [(stats.ROOM_TEMP, 20.0)]
+    feed.publish_frame(make_frame(), -70, 1000.0, "radio0", compact_stats)
+    feed.publish_frame(make_frame(fault=True), -71, 1001.0, "radio0", compact_stats)
+    feed.flush()
+
+    events = read_events(subscriber.get_nowait())
+    assert subscriber.empty()
+    frames = [event for event in events if event["event"] == "frame"]
+    assert [frame["fault"] for frame in frames] == [False, True]
+    assert frames[0]["stats"] == {"room_temperature_celsius": 20.0}
+    changes = [(e["field"], e["old"], e["new"]) for e in events if e["event"] == "change"]
+    # Every field is reported the first time a TRV is heard, then only real changes
+    assert len(changes) == 6
+    assert changes[-1] == ("fault", False, True)
+
+
+def test_slow_subscriber_dropped(make_frame):
+    feed = EventFeed(subscriber_buffer=2)
+    slow = feed.subscribe()
+    for i in range(3):
+        feed.publish_frame(make_frame(), -70, 1000.0 + i)
+        feed.flush()
+    assert slow.qsize() == 2
+    assert not feed.is_subscribed(slow)
+
+
+def test_sse_stream(make_frame):
+    feed = EventFeed(flush_interval=0.05)
+    feed.start("127.0.0.1", 0)
+    try:
+        connection = HTTPConnection("127.0.0.1", feed._server.server_address[1], timeout=5)
+        connection.request("GET", "/events")
+        response = connection.getresponse()
+        assert response.status == 200
+        assert response.getheader("Content-Type") == "text/event-stream"
+        deadline = time.monotonic() + 5
+        while not feed._subscribers and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert feed._subscribers
+        feed.publish_frame(make_frame(), -70, 1000.0)
+        line = response.fp.readline()
+        assert json.loads(line[len(b"data: ") :])["event"] == "frame"
+        connection.close()
+    finally:
+        feed.stop()
@@ -1,4 +1,9 @@
+from types import SimpleNamespace
+
+import pytest
+
 from heatmon.frame import Frame
+from heatmon.soak import encode_secure_frame
 
 # Packets prefixed by their length in bytes
 EXAMPLE_PACKET_1 = b"\x08\x4f\x02\x80\x81\x02\x00\x01\x23"
@@ -29,3 +34,64 @@ def test_3():
     assert decoded.id == b"\xaa\xaa\xaa\xaa"
     assert decoded.frame_type == Frame.SECURE_FRAME_TYPE
     assert not decoded.corrupt
+
+
+KEY_A = bytes(range(16))
+KEY_B = bytes(range(16, 32))
+TRV_ID = bytes.fromhex("f001020304050607")
+# Valve 25% with stats present, then truncated JSON as sent by the TRV
+STATS_DATA = b'\x19\x10{"T|C16":320,"B|cV":254\x00\x00'
+
+
+@pytest.fixture
+def registered(clean_frame):
+    def register(secure_key=None, previous_secure_key=None):
+        Frame.register_secure_key(KEY_A)
+        trv = SimpleNamespace(
+            id=TRV_ID,
+            name="bedroom",
+            secure_key=secure_key,
+            previous_secure_key=previous_secure_key,
+        )
+        Frame.register_known_trvs([trv])
+
+    return register
+
+
+def test_decrypt_with_global_key(registered):
+    registered()
+    decoded = Frame(encode_secure_frame(TRV_ID, KEY_A, 1, 42, STATS_DATA))
+    assert not decoded.corrupt
+    assert decoded.trv_name == "bedroom"
+    assert decoded.message_counter == 42
+    assert decoded.valve_open_percent == 25
+    assert decoded.json_text == '{"T|C16":320,"B|cV":254}'
+
+
+def test_decrypt_with_per_trv_key(registered):
+    registered(secure_key=KEY_B)
+    assert Frame(encode_secure_frame(TRV_ID, KEY_B, 1, 42, STATS_DATA)).trv_name == "bedroom"
+    assert Frame(encode_secure_frame(TRV_ID, KEY_A, 1, 43, STATS_DATA)).unknown_trv
+
+
+def test_rotating_to_unregistered_global_key(registered):
+    trv = SimpleNamespace(id=TRV_ID, name="bedroom", secure_key=None, previous_secure_key=KEY_B)
+    with pytest.raises(ValueError):
+        Frame.register_known_trvs([trv])
+
+
+def test_decrypt_during_key_rotation(registered):
+    registered(secure_key=KEY_B, previous_secure_key=KEY_A)
+    assert len(Frame.KNOWN_TRV_IDS_TO_DECRYPTORS[TRV_ID]) == 2
+    assert Frame(encode_secure_frame(TRV_ID, KEY_A, 1, 42, STATS_DATA)).trv_name == "bedroom"
+    assert Frame(encode_secure_frame(TRV_ID, KEY_B, 1, 43, STATS_DATA)).trv_name == "bedroom"
+    # Global key context is reused rather than rebuilt
+    assert len(Frame.DECRYPTORS_BY_KEY) == 2
+
+
+def test_stats_without_terminator(registered):
+    registered()
+    decoded = Frame(encode_secure_frame(TRV_ID, KEY_A, 1, 42, b'\x19\x10\xff\xfe{"T|C16":3'))
+    assert decoded.stats == b'\xff\xfe{"T|C16":3'
+    assert not decoded.stats_terminated
+    assert Frame(encode_secure_frame(TRV_ID, KEY_A, 1, 43, STATS_DATA)).stats_terminated
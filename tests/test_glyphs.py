@@ -0,0 +1,60 @@
+import random
+
+import pytest
+
+from heatmon.glyphs import GlyphCache
+
+WIDTH = 128
+HEIGHT = 32
+
+
+@pytest.fixture
+def font_path(tmp_path):
+    rng = random.Random(1)
+    path = tmp_path / "font5x8.bin"
+    path.write_bytes(bytes([5, 8]) + bytes(rng.getrandbits(8) for _ in range(256 * 5)))
+    return str(path)
+
+
+def reference_text(buf, font, text, y):
+    # Pixel by pixel, as adafruit_framebuf's text() & BitmapFont.draw_char()
+    for i, char in enumerate(text):
+        char_x = i * 6
+        for col in range(5):
+            line = font[2 + ord(char) * 5 + col]
+            for row in range(8):
+                px, py = char_x + col, y + row
+                if (line >> row) & 1 and px < WIDTH and py < HEIGHT:
+                    buf[(py >> 3) * WIDTH + px] |= 1 << (py & 7)
+
+
+def test_matches_per_pixel_rendering(font_path):
+    with open(font_path, "rb") as f:
+        font = f.read()
+    lines = ("TRVs: 12, last: 10:42", "Temps: 17.5 - 21.0", "Bmin 2.54V, Vmax 100% and more")
+    expected = bytearray(WIDTH * HEIGHT // 8)
+    for i, text in enumerate(lines):
+        reference_text(expected, font, text, i * 11)
+
+    buf = bytearray(b"\xff" * (WIDTH * HEIGHT // 8))
+    glyphs = GlyphCache(font_path, WIDTH)
+    glyphs.draw_lines(memoryview(buf), lines, 11)
+    assert buf == expected
+    # Cached lines redraw identically
+    glyphs.draw_lines(memoryview(buf), lines, 11)
+    assert buf == expected
+
+
+def test_line_cache_bounded(font_path):
+    glyphs = GlyphCache(font_path, WIDTH, max_cached_lines=4)
+    buf = bytearray(WIDTH * HEIGHT // 8)
+    for i in range(10):
+        glyphs.draw_lines(buf, (f"line {i}", "☃"), 11)
+    assert len(glyphs._lines) == 4
+
+
+def test_invalid_font(tmp_path):
+    path = tmp_path / "bad.bin"
+    path.write_bytes(bytes([5, 8, 0, 0]))
+    with pytest.raises(RuntimeError):
+        GlyphCache(str(path))
@@ -0,0 +1,97 @@
+import json
+import logging
+from queue import Queue
+
+import pytest
+
+from heatmon.logs import (
+    LOGS_DROPPED,
+    NonBlockingQueueHandler,
+    StructuredFormatter,
+    apply_config_levels,
+    configure_logging,
+    parse_module_levels,
+    stop_logging,
+)
+
+
+@pytest.fixture
+def restore_logging():
+    root = logging.getLogger()
+    handlers, level = list(root.handlers), root.level
+    yield
+    stop_logging()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    for handler in handlers:
+        root.addHandler(handler)
+    root.setLevel(level)
+    for module in ("heatmon.frame", "heatmon.radio"):
+        logging.getLogger(module).setLevel(logging.NOTSET)
+
+
+def make_record(msg, *args, **extra):
+    record = logging.LogRecord("heatmon.system", logging.INFO, "system.py", 1, msg, args, None)
+    record.__dict__.update(extra)
+    return record
+
+
+def test_structured_formats():
+    record = make_record("RSSI %s dBm via %s", -70.5, "radio0", trv="bedroom", rssi=-70.5)
+
+    fields = json.loads(StructuredFormatter("json", timestamps=False).format(record))
+    assert fields == {
+        "level": "INFO",
+        "logger": "heatmon.system",
+        "msg": "RSSI -70.5 dBm via radio0",
+        "trv": "bedroom",
+        "rssi": -70.5,
+    }
+    kv = StructuredFormatter("kv", timestamps=False).format(record)
+    assert kv == (
+        'level="INFO" logger="heatmon.system" msg="RSSI -70.5 dBm via radio0" '
+        'trv="bedroom" rssi=-70.5'
+    )
+
+
+class Summary:
+    formatted = 0
+
+    def __str__(self):
+        Summary.formatted += 1
+        return "summary"
+
+
+def test_queue_handler_formats_lazily_and_drops_when_full():
+    log_queue = Queue(maxsize=1)
+    handler = NonBlockingQueueHandler(log_queue)
+    summary = Summary()
+    handler.handle(make_record("Packet: %s", summary))
+    assert Summary.formatted == 0
+
+    before = LOGS_DROPPED._value.get()
+    handler.handle(make_record("Packet: %s", summary))
+    assert LOGS_DROPPED._value.get() == before + 1
+
+    assert log_queue.get_nowait().getMessage() == "Packet: summary"
+    assert Summary.formatted == 1
+
+
+def test_env_levels_override_config(restore_logging):
+    configure_logging(level="INFO", module_levels=parse_module_levels("heatmon.frame=error"))
+    apply_config_levels(
+        {"level": "WARNING", "modules": {"heatmon.frame": "DEBUG", "heatmon.radio": "DEBUG"}}
+    )
+    assert logging.getLogger().level == logging.INFO
+    assert logging.getLogger("heatmon.frame").level == logging.ERROR
+    assert logging.getLogger("heatmon.radio").level == logging.DEBUG
+
+
+def test_async_logging_writes_from_background_thread(restore_logging, capsys):
+    configure_logging(log_format="json", async_logging=True, journald=True)
+    logging.getLogger("heatmon.test").info("Packet: %s", "bedroom", extra={"trv": "bedroom"})
+    stop_logging()
+    fields = json.loads(capsys.readouterr().err)
+    assert fields["msg"] == "Packet: bedroom"
+    assert fields["trv"] == "bedroom"
+    assert "time" not in fields
@@ -0,0 +1,140 @@
+import gzip
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from prometheus_client import CollectorRegistry, Counter, Gauge
+
+from heatmon.push import PushExporter
+
+
+class Receiver(BaseHTTPRequestHandler):
+    batches = []
+    # Status codes for the next responses, then 204. "truncated" is a 200 cut off mid-body
+    statuses = []
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        assert self.headers["Content-Encoding"] == "gzip"
+        Receiver.batches.append(gzip.decompress(body).decode("utf-8"))
+        status = Receiver.statuses.pop(0) if Receiver.statuses else 204
+        if status == "truncated":
+            self.send_response(200)
+            self.send_header("Content-Length", "10")
+            self.end_headers()
+            self.wfile.write(b"OK")
+            self.close_connection = True
+            return
+        self.send_response(status)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def start_receiver(port=0):
+    server = HTTPServer(("127.0.0.1", port), Receiver)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def test_push_buffers_and_backfills_in_order(tmp_path):
+    Receiver.batches = []
+    registry = CollectorRegistry()
+    temp = Gauge("room_temperature", "Room temp", labelnames=["trv"], registry=registry)
+
+    # Find a free port, then close it so the first pushes fail
+    server = start_receiver()
+    port = server.server_address[1]
+    server.shutdown()
+    server.server_close()
+
+    pusher = PushExporter(
+        f"http://127.0.0.1:{port}/push",
+        buffer_dir=str(tmp_path),
+        instance="site-1",
+        timeout=1.0,
+        registry=registry,
+    )
+    temp.labels("bedroom").set(19.5)
+    assert not pusher.push_once(now=1000)
+    temp.labels("bedroom").set(20.0)
+    assert not pusher.push_once(now=1060)
+    assert len(list(tmp_path.glob("*.gz"))) == 2
+
+    server = start_receiver(port)
+    try:
+        temp.labels("bedroom").set(20.5)
+        assert pusher.push_once(now=1120)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert not list(tmp_path.glob("*.gz"))
+    assert Receiver.batches == [
+        'room_temperature{instance="site-1",trv="bedroom"} 19.5 1000000\n',
+        'room_temperature{instance="site-1",trv="bedroom"} 20.0 1060000\n',
+        'room_temperature{instance="site-1",trv="bedroom"} 20.5 1120000\n',
+    ]
+
+
+def test_push_buffer_is_bounded(tmp_path):
+    registry = CollectorRegistry()
+    Gauge("room_temperature", "Room temp", registry=registry).set(1)
+    pusher = PushExporter(
+        "http://127.0.0.1:9/push",
+        buffer_dir=str(tmp_path),
+        max_buffered=3,
+        timeout=1.0,
+        registry=registry,
+    )
+    for i in range(5):
+        pusher.push_once(now=i)
+
+    buffered = sorted(p.name for p in tmp_path.glob("*.gz"))
+    assert buffered == ["000000000002.gz", "000000000003.gz", "000000000004.gz"]
+
+
+def test_push_drops_rejected_batches_but_retries_server_errors(tmp_path):
+    Receiver.batches = []
+    Receiver.statuses = [400, 503, 429, "truncated"]
+    registry = CollectorRegistry()
+    temp = Gauge("room_temperature", "Room temp", registry=registry)
+    server = start_receiver()
+    try:
+        pusher = PushExporter(
+            f"http://127.0.0.1:{server.server_address[1]}/push",
+            buffer_dir=str(tmp_path),
+            instance="site-1",
+            timeout=1.0,
+            registry=registry,
+        )
+        temp.set(1)
+        # Rejected, so dropped rather than blocking later batches
+        assert pusher.push_once(now=1)
+        assert not list(tmp_path.glob("*.gz"))
+        temp.set(2)
+        # Refused with 503, buffered, then refused again with 429 when flushing the buffer
+        assert not pusher.push_once(now=2)
+        assert len(list(tmp_path.glob("*.gz"))) == 1
+        temp.set(3)
+        # Cut off response, so sent again
+        assert not pusher.push_once(now=3)
+        assert len(list(tmp_path.glob("*.gz"))) == 2
+        temp.set(4)
+        assert pusher.push_once(now=4)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert not list(tmp_path.glob("*.gz"))
+    values = [batch.split()[1] for batch in Receiver.batches]
+    assert values == ["1.0", "2.0", "2.0", "2.0", "2.0", "3.0", "4.0"]
+
+
+def test_batch_skips_created_samples(tmp_path):
+    registry = CollectorRegistry()
+    Counter("packets", "Packets received", registry=registry).inc()
+    pusher = PushExporter(
+        "http://127.0.0.1:9/push", buffer_dir=str(tmp_path), instance="site-1", registry=registry
+    )
+    assert pusher.collect_batch(now=1) == b'packets_total{instance="site-1"} 1.0 1000\n'
@@ -0,0 +1,51 @@
+from heatmon import stats
+from heatmon.fake_radio import FakeRadioBackend
+from heatmon.radio import PacketIngest, Radio, RadioConfig
+
+FRAME = b"\x4f\x02\x80\x81\x02\x00\x01\x23"
+
+
+def counter_value(metric, receiver_id):
+    return metric.labels(receiver_id)._value.get()
+
+
+def test_radios_share_deduplicating_ingest():
+    backend = FakeRadioBackend()
+    ingest = PacketIngest()
+    radios = [
+        Radio(RadioConfig({"id": "near", "dio0": 22}), ingest, backend),
+        Radio(RadioConfig({"id": "far", "chip_select": "CE0", "dio0": 23}), ingest, backend),
+    ]
+    near_packets = counter_value(stats.RECEIVER_PACKETS, "near")
+    far_duplicates = counter_value(stats.RECEIVER_DUPLICATES, "far")
+
+    backend.rfm69s["near"].receive(FRAME, -60)
+    backend.rfm69s["far"].receive(FRAME, -85)
+    backend.rfm69s["far"].receive(FRAME[:-1] + b"\x24", -86)
+
+    assert ingest.wait_for_packet_queue(0.1) == (bytearray(b"\x08" + FRAME), -60, "near")
+    assert ingest.wait_for_packet_queue(0.1) == (
+        bytearray(b"\x08" + FRAME[:-1] + b"\x24"),
+        -86,
+        "far",
+    )
+    assert ingest.wait_for_packet_queue(0.01) == (None, None, None)
+    assert counter_value(stats.RECEIVER_PACKETS, "near") == near_packets + 1
+    assert counter_value(stats.RECEIVER_DUPLICATES, "far") == far_duplicates + 1
+    assert stats.RECEIVER_RSSI.labels("far")._value.get() == -86
+    assert backend.rfm69s["far"].bitrate == 57600
+
+    for radio in radios:
+        radio.reset()
+    assert not backend.gpio.callbacks
+    assert not backend.gpio.pins
+
+
+def test_full_ingest_drops():
+    backend = FakeRadioBackend()
+    ingest = PacketIngest(maxsize=1)
+    Radio(RadioConfig(), ingest, backend)
+    dropped = stats.PACKETS_DROPPED._value.get()
+    backend.rfm69s["radio0"].receive(FRAME, -60)
+    assert not ingest.put(b"\x01\x02", -60, "radio0", timeout=0)
+    assert stats.PACKETS_DROPPED._value.get() == dropped + 1
@@ -0,0 +1,30 @@
+import random
+
+from heatmon.sketch import QuantileSketch
+
+
+def test_quantiles_within_relative_accuracy():
+    rng = random.Random(1)
+    values = sorted(rng.uniform(30, 120) for _ in range(10000))
+    sketch = QuantileSketch(relative_accuracy=0.02)
+    for value in values:
+        sketch.add(value)
+    for q in [0.1, 0.5, 0.9, 0.99]:
+        expected = values[int(q * (len(values) - 1))]
+        assert abs(sketch.quantile(q) - expected) <= 0.02 * expected
+
+
+def test_bounded_buckets():
+    sketch = QuantileSketch(relative_accuracy=0.01, max_buckets=16)
+    for i in range(1, 100000, 7):
+        sketch.add(i)
+    assert len(sketch._buckets) == 16
+    # Highest values keep their accuracy as the lowest buckets are merged
+    assert abs(sketch.quantile(1.0) - 99996) <= 0.01 * 99996
+
+
+def test_empty_and_zero():
+    sketch = QuantileSketch()
+    assert sketch.quantile(0.5) is None
+    sketch.add(0)
+    assert sketch.quantile(0.5) == 0.0
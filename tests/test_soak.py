@@ -0,0 +1,14 @@
+from heatmon import stats
+from heatmon.soak import run_soak
+
+
+def test_soak_short_run(clean_frame):
+    report = run_soak(num_trvs=10, duration=1.5, interval=0.1, gap_rate=0.2, restart_rate=0.05)
+    try:
+        assert report["processed"] > 50
+        assert report["processed"] + report["queue_drops"] <= report["generated"]
+        assert report["latency_p50_ms"] <= report["latency_p99_ms"]
+        assert report["metric_mismatches"] == []
+    finally:
+        for trv in list(stats.TRV_LAST_MESSAGE_COUNTER):
+            stats.forget_trv(trv)
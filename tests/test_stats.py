@@ -0,0 +1,110 @@
+import pytest
+
+from heatmon import stats
+
+
+@pytest.fixture(autouse=True)
+def clean_stats():
+    yield
+    for trv in list(stats.TRV_LAST_MESSAGE_COUNTER):
+        stats.forget_trv(trv)
+    stats.set_max_tracked_trvs(None)
+
+
+def label_values(metric):
+    return {sample.labels["trv"] for sample in metric._samples()}
+
+
+def test_parse_stats(make_frame):
+    stats.parse_stats(make_frame("bedroom", 5000), -70)
+    compact_stats = stats.parse_stats(make_frame("bedroom", 5003), -72)
+    assert compact_stats == [(stats.ROOM_TEMP, 20.0), (stats.BATTERY_VOLTAGE, 2.54)]
+    assert stats.ROOM_TEMP.labels("bedroom")._value.get() == 20.0
+    assert stats.BATTERY_VOLTAGE.labels("bedroom")._value.get() == 2.54
+    assert stats.VALVE_OPEN.labels("bedroom")._value.get() == 0.25
+    assert stats.SKIPPED_MESSAGES.labels("bedroom")._value.get() == 2
+
+
+def test_least_recent_trvs_evicted(make_frame):
+    stats.set_max_tracked_trvs(2)
+    stats.parse_stats(make_frame("a", 5000), -70)
+    stats.parse_stats(make_frame("b", 5000), -70)
+    stats.parse_stats(make_frame("a", 5001), -70)
+    stats.parse_stats(make_frame("c", 5000), -70)
+
+    assert list(stats.TRV_LAST_MESSAGE_COUNTER) == ["a", "c"]
+    assert set(stats.TRV_LAST_REPORT_TIME) == {"a", "c"}
+    for metric in stats.PER_TRV_METRICS:
+        assert "b" not in label_values(metric)
+    assert label_values(stats.SUCCESSFUL_MESSAGES) == {"a", "c"}
+
+
+def test_no_cap_by_default(make_frame):
+    # TRVs reporting in turn are all kept, so none lose their counts before reporting again
+    for message_counter in range(5000, 5003):
+        for i in range(70):
+            stats.parse_stats(make_frame(f"t{i}", message_counter), -70)
+    assert len(stats.TRV_LAST_MESSAGE_COUNTER) == 70
+    assert stats.SUCCESSFUL_MESSAGES.labels("t0")._value.get() == 3
+    stats.parse_stats(make_frame("t0", 5005), -70)
+    assert stats.SKIPPED_MESSAGES.labels("t0")._value.get() == 2
+
+
+def test_trv_state_memory_stays_flat(make_frame):
+    stats.set_max_tracked_trvs(4)
+    for i in range(4):
+        stats.parse_stats(make_frame(f"trv-{i}", 5000), -70)
+    full = stats.TRV_STATE_MEMORY._value.get()
+    assert full > 0
+    for i in range(4, 40):
+        stats.parse_stats(make_frame(f"trv-{i}", 5000), -70)
+    assert stats.TRV_STATE_MEMORY._value.get() <= full * 1.1
+
+
+def test_compact_stats():
+    parsed = list(stats.iter_compact_stats(b'{"T|C16":328,"vC|%":1234,"L":51,"gP":1,"zz":7'))
+    assert parsed == [
+        ("T|C16", stats.ROOM_TEMP, 20.5),
+        ("vC|%", stats.CUMULATIVE_VALVE, 12.34),
+        ("L", stats.LIGHT_LEVEL, 0.2),
+        ("gP", None, 1.0),
+        ("zz", "", 7),
+    ]
+
+
+def test_compact_stats_malformed():
+    assert list(stats.iter_compact_stats(b"")) == []
+    assert list(stats.iter_compact_stats(b'\xff\xfe{"T|C16":')) == []
+    # Cut off mid-value, as there was no NUL terminator
+    assert list(stats.iter_compact_stats(b'\xff\xfe{"T|C16":3', terminated=False)) == []
+    assert list(stats.iter_compact_stats(b'{"T|C16":3,"L":5', terminated=False)) == [
+        ("T|C16", stats.ROOM_TEMP, 0.1875)
+    ]
+    assert list(stats.iter_compact_stats(b'{"@":"a1b2","H|%":5x,"B|cV":2.5,"O":2')) == [
+        ("O", stats.OCCUPANCY2, 2.0)
+    ]
+
+
+def test_link_quantiles(monkeypatch, make_frame):
+    now = [1000.0]
+    monkeypatch.setattr(stats.time, "time", lambda: now[0])
+    for i, rssi in enumerate([-60, -70, -80, -90, -100] * 4):
+        now[0] += 240 if i % 5 else 480
+        stats.parse_stats(make_frame("bedroom", 5000 + i), rssi)
+
+    p10 = stats.RADIO_RSSI_QUANTILE.labels("bedroom", "0.1")._value.get()
+    p50 = stats.RADIO_RSSI_QUANTILE.labels("bedroom", "0.5")._value.get()
+    assert abs(p10 - -100) <= 2
+    assert abs(p50 - -80) <= 2
+    interval_p90 = stats.MESSAGE_INTERVAL_QUANTILE.labels("bedroom", "0.9")._value.get()
+    assert abs(interval_p90 - 480) <= 10
+
+    # Not exported once the TRV stops reporting
+    stats.recalc_recent_trv_count(now[0] + stats.RECENT_MESSAGE_MAX_AGE)
+    assert not list(stats.RADIO_RSSI_QUANTILE._samples())
+    assert not list(stats.MESSAGE_INTERVAL_QUANTILE._samples())
+    assert "bedroom" in stats.TRV_LINK_STATS
+
+    stats.forget_trv("bedroom")
+    assert not stats.TRV_LINK_STATS
+    assert not list(stats.RADIO_RSSI_QUANTILE._samples())
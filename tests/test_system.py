@@ -0,0 +1,44 @@
+import pytest
+
+from heatmon import stats
+from heatmon.system import System
+
+CONFIG = """trvs:
+  - id: f0 01 02 03 04 05 06 07
+    name: bedroom
+  - id: f1 01 02 03 04 05 06 07
+    name: lounge
+secure_key: 00 11 22 33 44 55 66 77 88 99 aa bb cc dd ee ff
+"""
+
+
+@pytest.fixture
+def config(tmp_path, clean_frame, monkeypatch):
+    monkeypatch.setattr(stats, "MAX_TRACKED_TRVS", None)
+
+    def write(extra=""):
+        path = tmp_path / "heatmon.yaml"
+        path.write_text(CONFIG + extra)
+        return str(path)
+
+    return write
+
+
+def test_max_tracked_trvs(config):
+    System(config())
+    assert stats.MAX_TRACKED_TRVS is None
+    System(config("max_tracked_trvs: 2\n"))
+    assert stats.MAX_TRACKED_TRVS == 2
+    with pytest.raises(ValueError, match="max_tracked_trvs"):
+        System(config("max_tracked_trvs: 1\n"))
+
+
+def test_radios(config):
+    assert [radio.id for radio in System(config()).radio_configs] == ["radio0"]
+    assert [radio.id for radio in System(config("radios:\n")).radio_configs] == ["radio0"]
+    system = System(config("radios:\n  - id: a\n  - id: b\n    dio0: 23\n"))
+    assert [(radio.id, radio.dio0) for radio in system.radio_configs] == [("a", 22), ("b", 23)]
+    with pytest.raises(ValueError, match="radios"):
+        System(config("radios: []\n"))
+    with pytest.raises(ValueError, match="radios"):
+        System(config("radios:\n  - id: a\n  - id: a\n"))